@@ -1,42 +1,15 @@
 #Conversion of Lipid species from MS-DIAL to LipidSearch
-import os
-import pandas as pd
+# The functions live in the ecn_tool package; this script runs them on the folders below.
+from ecn_tool import INDEX_OF_CLASS
+from ecn_tool.class_match import process_files
 
-def process_files(input_folder, index_file, output_folder):
-    index_df = pd.read_excel(index_file)
-    class_key_column = 'ClassKey'
-    subclass_key_column = 'SubClassKey'
-    ontology_column = 'Ontology'
-    for file_name in os.listdir(input_folder):
-        if file_name.endswith('.xlsx') or file_name.endswith('.xls'):
-            file_path = os.path.join(input_folder, file_name)
-            input_df = pd.read_excel(file_path)
-            if class_key_column not in input_df.columns or subclass_key_column not in input_df.columns:
-                print(f"Warning: The file {file_name} is missing the ClassKey or SubClassKey columns")
-                continue
-                
-            # Adduct  filtration：the M+H for TG and DG；M+HCOO for all lipids 
-            if 'Adduct' in input_df.columns:
-                before_filter = input_df.shape[0]
-                condition_tg_dg_h = (input_df['ClassKey'].isin(['TG', 'DG'])) & (input_df['Adduct'].str.strip() == 'M+H')
-                condition_hcooh = (input_df['Adduct'].str.strip() == 'M+HCOO')
-                combined_condition = condition_tg_dg_h | condition_hcooh
-                input_df = input_df[~combined_condition]
-                after_filter = input_df.shape[0]
-
-            input_df[ontology_column] = input_df.apply(
-                lambda row: get_ontology_value(row[class_key_column], row[subclass_key_column], index_df,
-                                               ontology_column),axis=1)
-            output_file_path = os.path.join(output_folder, file_name)
-            input_df.to_excel(output_file_path, index=False)
-def get_ontology_value(class_key, subclass_key, index_df, ontology_column):
-    matched_rows = index_df[(index_df['ClassKey'] == class_key) & (index_df['SubClassKey'] == subclass_key)]
-    if not matched_rows.empty:
-        return matched_rows.iloc[0][ontology_column]
-    else:
-        return None
-
-input_folder = 'Module2-input-lipidsearch'
-index_file = 'Module2-1-index of class.xlsx'  #Default Index file for nomenclature conversion
-output_folder = 'Module2-output-1'
-process_files(input_folder, index_file, output_folder)
+if __name__ == '__main__':
+    input_folder = 'Module2-input-lipidsearch'
+    index_file = INDEX_OF_CLASS  #Default Index file for nomenclature conversion (ecn_tool/data/Module2-1-index of class.xlsx)
+    output_folder = 'Module2-output-1'
+    output_format = 'xlsx'  # 'parquet' or 'arrow' keeps the intermediate tables columnar (requires pyarrow)
+    workers = None  # number of worker processes, None uses all cores
+    incremental = True  # skip input files unchanged since they were last processed
+    chunk_rows = None  # e.g. 50000 reads each input in batches of rows, for exports too large for memory
+    process_files(input_folder, index_file, output_folder, output_format, workers=workers, incremental=incremental,
+                  chunk_rows=chunk_rows)
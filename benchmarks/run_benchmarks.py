@@ -0,0 +1,299 @@
+#Benchmark of the ECN tool stages on the bundled QE and Astral data
+#Usage: python benchmarks/run_benchmarks.py [--datasets QE Astral] [--scales 1 10 100] [--input-format txt|xlsx]
+#       [--chunk-rows N] [--reference DIR|shipped] [--json FILE]
+#Regression check of a change: run `--scales 1 --output DIR` before it, then `--scales 1 --reference DIR` after it;
+#the second run exits with status 1 if any result differs from (or is missing in) DIR.
+import argparse
+import importlib.util
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+from collections import Counter
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from ecn_tool import INDEX_OF_CLASS, class_match, construction, instrument, lipidsearch, msdial, preprocess
+from ecn_tool.classmap import load_class_map
+from ecn_tool.storage import iter_table, list_tables, read_table, table_stem, write_chunks, write_table
+
+# Bundled inputs and the shipped outputs they are checked against; {polarity} is POS or NEG.
+DATASETS = {
+    'QE': {
+        'training': 'Module1-input-MSDIAL/QE/QE-{polarity}-20MIN-Mixture.xlsx',
+        'lipidsearch': 'Module2-input-lipidsearch/QE',
+        'msdial': 'Module3-input-MSDIAL/QE',
+        'reference': {'module1-1': 'Module1-output-1/QE', 'module1-2': 'Module1-output-2',
+                      'module2': 'Module2-output-2/QE', 'module3': 'Module3-output/QE-5%'},
+    },
+    'Astral': {
+        'training': 'Module1-input-MSDIAL/Astral/Astral_{polarity}_Mixture-25.xlsx',
+        'lipidsearch': 'Module2-input-lipidsearch/Astral',
+        'msdial': 'Module3-input-MSDIAL/Astral',
+        'reference': {'module1-1': 'Module1-output-1/Astral', 'module1-2': 'Module1-output-2',
+                      'module2': 'Module2-output-2/Astral', 'module3': 'Module3-output/Astral-5%'},
+    },
+}
+POLARITIES = ['POS', 'NEG']
+# Columns perturbed in the synthetic copies of upscaled inputs.
+INTENSITY_COLUMNS = ['Height', 'Area', 'Intensity', 'TopHeight']
+RT_COLUMNS = ['RT (min)', 'TopRT']
+# Formats the (upscaled) inputs are written in before they are read: native text exports or Excel.
+INPUT_FORMATS = {'txt': '.txt', 'xlsx': '.xlsx'}
+# The Parquet stages (intermediate tables and chunked writes) run only if pyarrow is installed.
+HAS_PYARROW = importlib.util.find_spec('pyarrow') is not None
+
+def upscale(df, factor, seed=0):
+    # factor copies of df; every copy after the first has jittered intensities and RTs but the same names,
+    # so parsing, matching and deduplication see realistic repeats.
+    if factor == 1:
+        return df
+    rng = np.random.default_rng(seed)
+    copies = [df]
+    for _ in range(factor - 1):
+        copy = df.copy()
+        for column in INTENSITY_COLUMNS:
+            if column in copy.columns and pd.api.types.is_numeric_dtype(copy[column]):
+                copy[column] = copy[column] * rng.uniform(0.5, 1.5, len(copy))
+        for column in RT_COLUMNS:
+            if column in copy.columns and pd.api.types.is_numeric_dtype(copy[column]):
+                copy[column] = copy[column] * (1 + rng.normal(0, 0.002, len(copy)))
+        copies.append(copy)
+    return pd.concat(copies, ignore_index=True)
+
+def prepare_input(path, scale, input_format, folder):
+    # The input at the given scale, written to folder in input_format so that reading it is timed at that scale.
+    # The bundled Excel files are used as they are at scale 1.
+    if scale == 1 and input_format == 'xlsx':
+        return path
+    df = upscale(read_table(path), scale)
+    output_path = os.path.join(folder, table_stem(path) + INPUT_FORMATS[input_format])
+    os.makedirs(folder, exist_ok=True)
+    if input_format == 'txt':
+        df.to_csv(output_path, sep='\t', index=False)
+    else:
+        write_table(df, output_path)
+    return output_path
+
+def read_chunks(path, chunk_rows):
+    # Reads the table chunk by chunk as the modules do with chunk_rows, keeping one chunk in memory; returns the rows.
+    return sum(len(chunk) for chunk in iter_table(path, chunk_rows))
+
+def write_in_chunks(df, path, chunk_rows):
+    return write_chunks((df.iloc[start:start + chunk_rows] for start in range(0, len(df), chunk_rows)), path)
+
+class StageTimer:
+    # Times every stage as an instrument step, so its peak_rss_mb is the peak RSS during the stage alone
+    # (Linux only, None elsewhere) and process_peak_rss_mb that of the process so far.
+    def __init__(self):
+        self.records = []
+        instrument.enable()
+
+    def run(self, labels, stage, func, *args, rows_in=None):
+        frames = [arg for arg in args if isinstance(arg, pd.DataFrame)]
+        if rows_in is None and frames:
+            rows_in = len(frames[0])
+        with instrument.step(stage):
+            result = func(*args)
+        # The step of the stage ends last; the steps the modules record within it are dropped.
+        event = instrument.collect()[-1]
+        if isinstance(result, pd.DataFrame):
+            rows_out = len(result)
+        else:
+            rows_out = result if isinstance(result, int) else None
+        self.records.append({**labels, 'stage': stage, 'rows_in': rows_in, 'rows_out': rows_out,
+                             'seconds': event['seconds'], 'peak_rss_mb': event['peak_rss_mb'],
+                             'process_peak_rss_mb': event['process_peak_rss_mb']})
+        return result
+
+def _row_counter(df):
+    df = df.copy()
+    for column in df.columns:
+        if pd.api.types.is_float_dtype(df[column]):
+            df[column] = df[column].round(6)
+    return Counter(map(tuple, df.astype(str).itertuples(index=False)))
+
+def compare(output_path, reference_path, exact=True):
+    # Compares two result files: exactly (same columns, rows and values in the same order) against an earlier
+    # run of the benchmark, or on their shared columns ignoring row order against the shipped outputs.
+    if not os.path.exists(reference_path):
+        return 'no reference'
+    result = pd.read_excel(output_path)
+    reference = pd.read_excel(reference_path)
+    if exact:
+        if list(result.columns) != list(reference.columns):
+            return f"differs: columns {list(result.columns)} vs {list(reference.columns)}"
+        if len(result) != len(reference):
+            return f"differs: {len(result)} rows vs {len(reference)} reference rows"
+        rows = (result.ne(reference) & ~(result.isna() & reference.isna())).any(axis=1)
+        return 'identical' if not rows.any() else f"differs: {int(rows.sum())} of {len(result)} rows"
+    columns = [column for column in result.columns if column in reference.columns]
+    ours, theirs = _row_counter(result[columns]), _row_counter(reference[columns])
+    if ours == theirs:
+        return 'identical'
+    return (f"differs: {sum((ours - theirs).values())} of {len(result)} rows not in reference, "
+            f"{sum((theirs - ours).values())} of {len(reference)} reference rows missing")
+
+def write_excel(df, path, sheet_name):
+    write_table(df, path, sheet_name)
+    return df
+
+def run_dataset(dataset, scale, output_folder, reference_root, input_format='txt', chunk_rows=50000):
+    # (stage measurements, checks) of one dataset at one scale. The inputs are upscaled and written in
+    # input_format first, untimed, so the read stages read files of the measured size.
+    config = DATASETS[dataset]
+    timer = StageTimer()
+    checks = []
+    def reference(module, file_name):
+        if reference_root is None:
+            return None
+        if reference_root == 'shipped':
+            return os.path.join(ROOT, config['reference'][module], file_name)
+        return os.path.join(reference_root, module, dataset if module != 'module1-2' else '', file_name)
+    def check(module, output_path):
+        path = reference(module, os.path.basename(output_path))
+        if scale == 1 and path is not None:
+            checks.append({'dataset': dataset, 'module': module, 'file': os.path.basename(output_path),
+                           'result': compare(output_path, path, exact=reference_root != 'shipped')})
+
+    class_map = load_class_map(INDEX_OF_CLASS)
+    with tempfile.TemporaryDirectory() as input_folder:
+        for polarity in POLARITIES:
+            training_file = prepare_input(os.path.join(ROOT, config['training'].format(polarity=polarity)), scale,
+                                          input_format, os.path.join(input_folder, 'module1'))
+            training_name = table_stem(training_file)
+            labels = {'dataset': dataset, 'scale': scale, 'module': 'module1', 'file': training_name}
+            df = timer.run(labels, 'read', read_table, training_file)
+            timer.run(labels, 'read_chunks', read_chunks, training_file, chunk_rows)
+            df = timer.run(labels, 'parse', preprocess.process_lipid_group_key, df)
+            df = timer.run(labels, 'dedup', preprocess.filter_by_max_height, df)
+            output_path = os.path.join(output_folder, 'module1-1', dataset, training_name + '.xlsx')
+            timer.run(labels, 'write', write_excel, df, output_path, 'Sheet1')
+            check('module1-1', output_path)
+            if HAS_PYARROW:
+                # The columnar intermediate tables, written whole or in chunks, and read back.
+                parquet_path = os.path.join(input_folder, 'module1-1', training_name + '.parquet')
+                timer.run(labels, 'write_parquet', write_table, df, parquet_path)
+                timer.run(labels, 'read_parquet', read_table, parquet_path)
+                timer.run(labels, 'write_chunks', write_in_chunks, df,
+                          os.path.join(input_folder, 'module1-1', training_name + '-chunks.parquet'), chunk_rows)
+            model_folder = os.path.join(output_folder, 'module1-2')
+            os.makedirs(model_folder, exist_ok=True)
+            model = timer.run(labels, 'fit', construction.process_excel, training_name + '.xlsx', model_folder, df)
+            check('module1-2', os.path.join(model_folder, training_name + '_processed.xlsx'))
+
+            index_table = lipidsearch.read_index_table(model)
+            for file_name in sorted(list_tables(os.path.join(ROOT, config['lipidsearch']))):
+                if polarity not in file_name:
+                    continue
+                path = prepare_input(os.path.join(ROOT, config['lipidsearch'], file_name), scale, input_format,
+                                     os.path.join(input_folder, 'module2'))
+                name = table_stem(path)
+                labels = {'dataset': dataset, 'scale': scale, 'module': 'module2', 'file': name}
+                df = timer.run(labels, 'read', read_table, path)
+                timer.run(labels, 'read_chunks', read_chunks, path, chunk_rows)
+                df = timer.run(labels, 'class_match', class_match.process_file, name, df, class_map, None)
+                df = timer.run(labels, 'match', lipidsearch.process_excel_step2, df, index_table)
+                df = timer.run(labels, 'filter', lipidsearch.filter_matches, df)
+                output_path = os.path.join(output_folder, 'module2', dataset, name + '_processed.xlsx')
+                timer.run(labels, 'write', write_excel, df, output_path, 'ProcessedData')
+                check('module2', output_path)
+
+            index_table = msdial.read_index_table(model)
+            msdial_inputs = {}
+            for file_name in sorted(list_tables(os.path.join(ROOT, config['msdial']))):
+                if polarity not in file_name:
+                    continue
+                path = prepare_input(os.path.join(ROOT, config['msdial'], file_name), scale, input_format,
+                                     os.path.join(input_folder, 'module3'))
+                name = table_stem(path)
+                msdial_inputs[name] = path
+                labels = {'dataset': dataset, 'scale': scale, 'module': 'module3', 'file': name}
+                df = timer.run(labels, 'read', read_table, path)
+                timer.run(labels, 'read_chunks', read_chunks, path, chunk_rows)
+                df = timer.run(labels, 'match', msdial.process_excel_step2, df, index_table)
+                df = timer.run(labels, 'filter', msdial.filter_matches, df)
+                output_path = os.path.join(output_folder, 'module3', dataset, name + '_processed.xlsx')
+                timer.run(labels, 'write', write_excel, df, output_path, 'ProcessedData')
+                check('module3', output_path)
+
+            # Module3 as a batch over the same inputs, then again with all of them unchanged: the second run
+            # only hashes the inputs and finds them in the manifest (incremental runs).
+            labels = {'dataset': dataset, 'scale': scale, 'module': 'module3', 'file': f'{polarity} batch'}
+            model_file = os.path.join(model_folder, training_name + '_processed.json')
+            batch_folder = os.path.join(input_folder, 'module3-batch', polarity)
+            for stage in ('batch', 'batch_cached'):
+                timer.run(labels, stage, msdial.main_process, None, model_file, batch_folder, msdial_inputs, 1)
+    return timer.records, checks
+
+def run_isolated(dataset, scale, output_folder, reference_root, input_format, chunk_rows):
+    # run_dataset in a new process, so the process peak memory is that of this dataset and scale alone and
+    # not the peak left by an earlier, larger one (the peak RSS of a process only grows).
+    with multiprocessing.get_context('spawn').Pool(1) as pool:
+        return pool.apply(run_dataset, (dataset, scale, output_folder, reference_root, input_format, chunk_rows))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark of the ECN tool stages on the bundled data')
+    parser.add_argument('--datasets', nargs='+', default=list(DATASETS), choices=list(DATASETS))
+    parser.add_argument('--scales', nargs='+', type=int, default=[1, 10, 100],
+                        help='row multipliers; inputs are upscaled with jittered synthetic copies')
+    parser.add_argument('--input-format', default='txt', choices=list(INPUT_FORMATS),
+                        help='format the upscaled inputs are written in before they are read: native text exports '
+                             "(default) or Excel; 'xlsx' reads the bundled files as they are at scale 1")
+    parser.add_argument('--chunk-rows', type=int, default=50000,
+                        help='rows per chunk of the chunked read and write stages (default: %(default)s)')
+    parser.add_argument('--output', help='folder for the benchmark outputs (default: a temporary folder)')
+    parser.add_argument('--reference', default='none',
+                        help="checks the scale-1 results: the --output folder of an earlier run to compare with "
+                             "exactly (exit status 1 on any difference), 'shipped' to compare the shared columns with "
+                             "the repository's Module*-output* folders (which differ where the tool has changed since; "
+                             "reported only), or 'none' (default)")
+    parser.add_argument('--json', help='also write every stage measurement as JSON lines to this file')
+    args = parser.parse_args(argv)
+    reference_root = args.reference if args.reference in ('none', 'shipped') else os.path.abspath(args.reference)
+    reference_root = None if reference_root == 'none' else reference_root
+    output_root = os.path.abspath(args.output) if args.output else None
+    if output_root is not None and reference_root == output_root:
+        parser.error('--reference must not be the --output folder of this run')
+
+    os.chdir(ROOT)
+    records = []
+    checks = []
+    with tempfile.TemporaryDirectory() as temporary_folder:
+        output_folder = output_root or temporary_folder
+        for scale in args.scales:
+            for dataset in args.datasets:
+                print(f"Benchmarking {dataset} x{scale} ...", flush=True)
+                dataset_records, dataset_checks = run_isolated(dataset, scale, output_folder, reference_root,
+                                                               args.input_format, args.chunk_rows)
+                records += dataset_records
+                checks += dataset_checks
+
+    summary = pd.DataFrame(records).groupby(['dataset', 'scale', 'module', 'stage'], sort=False).agg(
+        files=('file', 'nunique'), rows_in=('rows_in', lambda rows: rows.sum(min_count=1)),
+        rows_out=('rows_out', lambda rows: rows.sum(min_count=1)),
+        seconds=('seconds', 'sum'), peak_rss_mb=('peak_rss_mb', 'max'),
+        process_peak_rss_mb=('process_peak_rss_mb', 'max'))
+    print(summary.to_string(float_format=lambda value: f"{value:.3f}"))
+    if checks:
+        print(pd.DataFrame(checks).to_string(index=False))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record) + '\n')
+    if reference_root not in (None, 'shipped'):
+        if 1 not in args.scales:
+            print(f"No scale-1 run to check against {reference_root}.")
+            return 1
+        differing = [check for check in checks if check['result'] != 'identical']
+        if differing:
+            print(f"{len(differing)} of {len(checks)} results are not identical to those in {reference_root}.")
+            return 1
+        print(f"All {len(checks)} results are identical to those in {reference_root}.")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,26 @@
+#ECN tool: the module functions as a library, and the `ecn` command line (ecn_tool.cli)
+from importlib import import_module
+from importlib.resources import files
+
+# Index of class shipped with the tool (Module2-1) as package data, so it is found from any working folder
+# and after `pip install .`.
+INDEX_OF_CLASS = str(files(__name__) / 'data' / 'Module2-1-index of class.xlsx')
+
+# Public functions and the module holding them. They are imported on first use, so `import ecn_tool`
+# does not load pandas. process_excel_step2/filter_and_save are the LipidSearch (Module2-2) versions;
+# the MS-DIAL (Module3) ones are in ecn_tool.msdial.
+_EXPORTS = {
+    'process_lipid_group_key': 'preprocess',
+    'filter_by_max_height': 'preprocess',
+    'process_excel': 'construction',
+    'process_files': 'class_match',
+    'process_excel_step2': 'lipidsearch',
+    'filter_and_save': 'lipidsearch',
+    'run_pipeline': 'pipeline',
+}
+__all__ = list(_EXPORTS)
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module 'ecn_tool' has no attribute '{name}'")
+    return getattr(import_module(f'ecn_tool.{_EXPORTS[name]}'), name)
@@ -0,0 +1,6 @@
+#python -m ecn_tool: same as the `ecn` command
+import sys
+from ecn_tool.cli import main
+
+if __name__ == '__main__':
+    sys.exit(main())
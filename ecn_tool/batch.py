@@ -0,0 +1,50 @@
+#Process-pool batch runner shared by the modules
+import os
+import traceback
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from ecn_tool import instrument
+
+# One entry per task, in submission order. error is None on success, otherwise the formatted traceback.
+BatchResult = namedtuple('BatchResult', ['name', 'value', 'error'])
+
+def _call(func, args, name=None, labelled=True):
+    try:
+        if not labelled:
+            return func(*args), None
+        # Events recorded by the task are labelled with its stage (the module of func) and name.
+        with instrument.task(func.__module__.rsplit('.', 1)[-1], name):
+            return func(*args), None
+    except Exception:
+        return None, traceback.format_exc()
+
+def _call_worker(func, args, name, config, labelled=True):
+    # _call in a worker process, with the instrumentation settings of the parent; its events are sent back.
+    instrument.configure(config)
+    value, error = _call(func, args, name, labelled)
+    return value, error, instrument.collect()
+
+def run_batch(func, tasks, workers=None, labelled=True):
+    # tasks: list of (name, args) pairs; func(*args) runs once per task.
+    # workers: number of processes, None uses every core and 1 runs serially in this process.
+    # labelled=False for the parts of one file (e.g. the groups fitted by Module1-2), which are not
+    # instrumented as tasks of their own.
+    tasks = list(tasks)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(tasks)))
+    if workers == 1:
+        return [BatchResult(name, *_call(func, args, name, labelled)) for name, args in tasks]
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [(name, executor.submit(_call_worker, func, args, name, instrument.config(), labelled))
+                   for name, args in tasks]
+        for name, future in futures:
+            try:
+                value, error, events = future.result()
+                instrument.extend(events)
+                results.append(BatchResult(name, value, error))
+            except Exception:
+                # The worker process died (e.g. out of memory) before it could report back.
+                results.append(BatchResult(name, None, traceback.format_exc()))
+    return results
@@ -0,0 +1,114 @@
+#Conversion of Lipid species from MS-DIAL to LipidSearch (Module2-1)
+import os
+import pandas as pd
+from ecn_tool import instrument
+from ecn_tool.batch import run_batch
+from ecn_tool.classmap import load_class_map, map_ontology, unmapped_summary
+from ecn_tool.manifest import load_manifest, plan, record, save_manifest, source_sha256
+from ecn_tool.storage import (export_columns, file_sha256, iter_table, read_table, table_files, table_path,
+                              write_chunks, write_table)
+
+# Columns read from a native LipidSearch text export (see ecn_tool.storage.EXPORT_DTYPES).
+INPUT_COLUMNS = ['ClassKey', 'SubClassKey', 'Adduct', 'LipidGroupKey', 'LipidMolec', 'TopRT', 'Intensity']
+
+def process_files(input_folder, index_file, output_folder, output_format='xlsx', frames=None, workers=None,
+                  incremental=True, chunk_rows=None):
+    # frames: optional {name: DataFrame or path} already in memory, used instead of reading input_folder.
+    # workers: number of processes the files are spread over (None: all cores, 1: serial).
+    # incremental: skip inputs whose output was already made from the same content, index of class and format.
+    # chunk_rows: process each input in batches of this many rows, to bound the memory used by large files.
+    # The index of class is compiled once into a (ClassKey, SubClassKey) lookup, cached across batches.
+    # Returns {name: DataFrame with Ontology}, or the output path for a skipped file.
+    if output_folder:
+        os.makedirs(output_folder, exist_ok=True)
+    class_map = load_class_map(index_file, output_folder)
+    if frames is None:
+        frames = table_files(input_folder)
+    manifest = load_manifest(output_folder) if incremental and output_folder else None
+    index_hash = source_sha256(index_file) if manifest is not None else None
+    keys, cached = plan(manifest, output_folder, 'class_match', frames, index_hash, output_format)
+    results = {name: outputs[0] for name, outputs in cached.items()}
+    tasks = [(file_name, (file_name, frames[file_name], class_map, output_folder, output_format, chunk_rows))
+             for file_name in keys]
+    for result in run_batch(process_file, tasks, workers):
+        if result.error:
+            print(f"Error processing {result.name}: {result.error}")
+        elif result.value is not None:
+            results[result.name] = result.value
+            if manifest is not None:
+                record(manifest, output_folder, result.name, keys[result.name],
+                       [table_path(output_folder, result.name, output_format)])
+    if manifest is not None:
+        save_manifest(manifest, output_folder)
+    return {name: results[name] for name in frames if name in results}
+
+def classify(input_df, class_map, class_key_column='ClassKey', subclass_key_column='SubClassKey',
+             ontology_column='Ontology'):
+    # Adduct filtration and Ontology of a table (or a chunk of it), with the summary of its unmapped class pairs.
+    # Adduct  filtration：the M+H for TG and DG；M+HCOO for all lipids 
+    if 'Adduct' in input_df.columns:
+        # astype(str) also covers an Adduct column read as all-empty (float).
+        adduct = input_df['Adduct'].astype(str).str.strip()
+        condition_tg_dg_h = (input_df['ClassKey'].isin(['TG', 'DG'])) & (adduct == 'M+H')
+        condition_hcooh = (adduct == 'M+HCOO')
+        combined_condition = condition_tg_dg_h | condition_hcooh
+        input_df = input_df[~combined_condition]
+        instrument.dropped('adduct filter', len(combined_condition), len(input_df))
+
+    ontology, unmapped = map_ontology(input_df[class_key_column], input_df[subclass_key_column], class_map)
+    # assign returns a new frame: input_df may be the caller's table, or a filtered slice of it.
+    input_df = input_df.assign(**{ontology_column: ontology})
+    return input_df, unmapped_summary(input_df, unmapped, class_key_column, subclass_key_column)
+
+def report_unmapped(file_name, summary):
+    if not summary.empty:
+        pairs = ', '.join(f"{class_key}/{subclass_key} ({rows})" for class_key, subclass_key, rows in summary.itertuples(index=False))
+        print(f"{file_name}: {summary['Rows'].sum()} rows in {len(summary)} ClassKey/SubClassKey pairs have no Ontology "
+              f"in the index of class: {pairs}")
+
+def process_file(file_name, source, class_map, output_folder, output_format='xlsx', chunk_rows=None):
+    # chunk_rows: classify the input in batches of this many rows, written out as they are done; the output
+    # path is then returned instead of the table (or the concatenated table without an output folder).
+    class_key_column = 'ClassKey'
+    subclass_key_column = 'SubClassKey'
+    if chunk_rows:
+        return process_file_chunks(file_name, source, class_map, output_folder, output_format, chunk_rows)
+    with instrument.step('read') as counts:
+        input_df = read_table(source, export_columns(source, INPUT_COLUMNS))
+        counts['rows_out'] = len(input_df)
+    if class_key_column not in input_df.columns or subclass_key_column not in input_df.columns:
+        print(f"Warning: The file {file_name} is missing the ClassKey or SubClassKey columns")
+        return None
+    with instrument.step('classify', len(input_df)) as counts:
+        input_df, summary = classify(input_df, class_map)
+        counts['rows_out'] = len(input_df)
+    report_unmapped(file_name, summary)
+    if output_folder:
+        with instrument.step('write', len(input_df)):
+            output_file = write_table(input_df, table_path(output_folder, file_name, output_format))
+        input_df.attrs['sha256'] = file_sha256(output_file)
+    return input_df
+
+def process_file_chunks(file_name, source, class_map, output_folder, output_format, chunk_rows):
+    summaries = []
+    def classified():
+        chunks = iter_table(source, chunk_rows, export_columns(source, INPUT_COLUMNS))
+        for chunk in instrument.counted(chunks, counts):
+            if 'ClassKey' not in chunk.columns or 'SubClassKey' not in chunk.columns:
+                print(f"Warning: The file {file_name} is missing the ClassKey or SubClassKey columns")
+                return
+            chunk, summary = classify(chunk, class_map)
+            summaries.append(summary)
+            counts['rows_out'] = (counts['rows_out'] or 0) + len(chunk)
+            yield chunk
+    # Reading, classification and writing run chunk by chunk, so they are timed as one step.
+    with instrument.step('read+classify+write') as counts:
+        if output_folder:
+            result = write_chunks(classified(), table_path(output_folder, file_name, output_format))
+        else:
+            chunks = list(classified())
+            result = pd.concat(chunks) if chunks else None
+    if summaries:
+        summary = pd.concat(summaries).groupby(['ClassKey', 'SubClassKey'], dropna=False, sort=False)['Rows'].sum()
+        report_unmapped(file_name, summary.sort_values(ascending=False, kind='stable').reset_index())
+    return result
@@ -0,0 +1,65 @@
+#Compiled (ClassKey, SubClassKey) -> Ontology mapping of the index of class used by Module2-1
+import json
+import os
+import numpy as np
+import pandas as pd
+from ecn_tool.storage import read_table
+
+CACHE_FOLDER = '.ecn_cache'
+_compiled = {}
+
+def compile_class_map(index_df):
+    # Ontology Series indexed by (ClassKey, SubClassKey); the first row of a repeated pair wins.
+    index_df = index_df.dropna(subset=['ClassKey', 'SubClassKey'])
+    index_df = index_df.drop_duplicates(subset=['ClassKey', 'SubClassKey'], keep='first')
+    index = pd.MultiIndex.from_arrays([index_df['ClassKey'], index_df['SubClassKey']])
+    return pd.Series(index_df['Ontology'].to_numpy(dtype=object), index=index, name='Ontology')
+
+def _cache_path(index_file, cache_folder):
+    return os.path.join(cache_folder, CACHE_FOLDER, os.path.basename(index_file) + '.classmap.json')
+
+def load_class_map(index_file, cache_folder=None):
+    # The compiled map is kept in memory and, with a cache_folder (the output folder of the run), in a JSON file
+    # under its .ecn_cache, both keyed on the index file's path, modification time and size. The index file's own
+    # folder is never written to: the default index is package data, possibly in a read-only install.
+    if isinstance(index_file, pd.DataFrame):
+        return compile_class_map(index_file)
+    stat = os.stat(index_file)
+    key = (os.path.abspath(index_file), stat.st_mtime_ns, stat.st_size)
+    if key in _compiled:
+        return _compiled[key]
+    cache_file = _cache_path(index_file, cache_folder) if cache_folder else None
+    try:
+        if cache_file is None:
+            raise ValueError("no class map cache")
+        with open(cache_file, encoding='utf-8') as f:
+            cached = json.load(f)
+        if (cached['path'], cached['mtime_ns'], cached['size']) != key:
+            raise ValueError("stale class map cache")
+        class_map = compile_class_map(pd.DataFrame(cached['rows'], columns=['ClassKey', 'SubClassKey', 'Ontology']))
+    except (OSError, ValueError, KeyError):
+        class_map = compile_class_map(read_table(index_file))
+        if cache_file is not None:
+            rows = [[class_key, subclass_key, None if pd.isna(ontology) else ontology]
+                    for (class_key, subclass_key), ontology in class_map.items()]
+            try:
+                os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+                with open(cache_file, 'w', encoding='utf-8') as f:
+                    json.dump({'path': key[0], 'mtime_ns': key[1], 'size': key[2], 'rows': rows}, f)
+            except OSError as e:
+                print(f"Could not cache the compiled index of class in {cache_file}: {e}")
+    _compiled[key] = class_map
+    return class_map
+
+def map_ontology(class_key, subclass_key, class_map):
+    # Ontology of every (ClassKey, SubClassKey) pair (None where the pair is not in the map), and the unmapped mask.
+    positions = class_map.index.get_indexer(pd.MultiIndex.from_arrays([class_key, subclass_key]))
+    # Position -1 (not found) picks the trailing None.
+    ontology = np.append(class_map.to_numpy(dtype=object), None)[positions]
+    return ontology, positions < 0
+
+def unmapped_summary(df, unmapped, class_key_column='ClassKey', subclass_key_column='SubClassKey'):
+    # Row count of every (ClassKey, SubClassKey) pair without an Ontology, most frequent first.
+    counts = df.loc[unmapped, [class_key_column, subclass_key_column]].value_counts(dropna=False)
+    # Category columns (text exports) also count the pairs that never occur.
+    return counts[counts > 0].rename('Rows').reset_index()
@@ -0,0 +1,72 @@
+#Command line interface: ecn run --model ... --inputs ...
+import argparse
+import os
+from ecn_tool import INDEX_OF_CLASS
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='ecn', description='ECN tool: lipid annotation of MS-DIAL and LipidSearch '
+                                                             'results with Equivalent Carbon Number models')
+    commands = parser.add_subparsers(dest='command', required=True)
+    run = commands.add_parser('run', help='run Module 1 -> 2 -> 3 in one process')
+    run.add_argument('--model', required=True,
+                     help='ECN model file from Module1-2 (.json or _processed.xlsx), a folder of them (e.g. '
+                          'Module1-output-2) to use the model of each input\'s instrument and polarity, or MS-DIAL '
+                          'training data (e.g. a Module1-input-MSDIAL file) to build the model from')
+    run.add_argument('--pool', action='store_true',
+                     help='fit one model per instrument and polarity (e.g. QE-POS-pooled) on all the MS-DIAL training '
+                          'files of --model (a folder or file), and match every input with the model of its own')
+    run.add_argument('--inputs', nargs='+', required=True,
+                     help='LipidSearch and MS-DIAL result tables, or folders of them')
+    run.add_argument('--index-of-class', default=INDEX_OF_CLASS,
+                     help='index of class used to convert LipidSearch classes, needed only for LipidSearch inputs '
+                          '(default: the one shipped with the tool, %(default)s)')
+    run.add_argument('--output', default='.', help='folder receiving the Module*-output* folders (default: %(default)s)')
+    run.add_argument('--format', default='xlsx', choices=['xlsx', 'parquet', 'arrow'],
+                     help='format of the intermediate tables (default: %(default)s)')
+    run.add_argument('--workers', type=int, default=1,
+                     help='number of worker processes per module, 0 uses all cores (default: %(default)s)')
+    run.add_argument('--no-intermediate', action='store_true',
+                     help='do not write the Module1-output-1 and Module2-output-1 tables')
+    run.add_argument('--chunk-rows', type=int, default=None,
+                     help='read the inputs in batches of this many rows, to bound memory on very large exports')
+    run.add_argument('--tolerance', type=float, default=5.0,
+                     help='largest δRT of an ECN match, in --tolerance-unit (default: %(default)s)')
+    run.add_argument('--tolerance-unit', default='%', choices=['%', 'min'],
+                     help='unit of --tolerance: percent of the RT or minutes (default: %(default)s)')
+    run.add_argument('--consolidate', choices=['xlsx', 'parquet'],
+                     help='also save the results of all inputs as one long table of species by sample, a species '
+                          'matrix and MS-DIAL vs LipidSearch overlap statistics per class, in Consolidated-output')
+    run.add_argument('--stats', metavar='FILE',
+                     help='save the time, rows in and out, rows dropped by each filter, fit iterations and peak memory '
+                          'of every step as JSON lines')
+    run.add_argument('--summary', action='store_true', help='print these statistics as tables at the end of the run')
+    run.add_argument('--profile', choices=['cprofile', 'pyinstrument'],
+                     help='profile every file of every module (pyinstrument must be installed for pyinstrument)')
+    run.add_argument('--profile-dir', default='profiles',
+                     help='folder receiving the profiles, one per module and file (default: %(default)s)')
+    run.add_argument('--force', action='store_true',
+                     help='process every input again, including those unchanged since the last run')
+    return parser
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command == 'run':
+        # The index of class is checked by run_pipeline, and only if there are LipidSearch inputs.
+        for path in [args.model] + args.inputs:
+            if not os.path.exists(path):
+                parser.error(f"{path} does not exist")
+        # pandas and the modules are imported only here, so `ecn --help` starts instantly.
+        from ecn_tool import instrument
+        from ecn_tool.pipeline import run_pipeline
+        if args.stats or args.summary or args.profile:
+            instrument.enable(args.profile, args.profile_dir)
+        results = run_pipeline(args.model, args.inputs, args.output, args.index_of_class, args.format,
+                               args.workers or None, not args.no_intermediate, not args.force,
+                               args.chunk_rows, args.tolerance, args.tolerance_unit, args.consolidate, args.pool)
+        if args.stats:
+            instrument.report(args.stats)
+        if args.summary:
+            instrument.report()
+        return 0 if results else 1
+    return 0
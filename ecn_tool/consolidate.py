@@ -0,0 +1,166 @@
+#Consolidation of the Module2-2 and Module3 results of all samples: long table, species matrix and overlap statistics
+import os
+import re
+import pandas as pd
+from ecn_tool.batch import run_batch
+from ecn_tool.dedup import keep_max_rows
+from ecn_tool.registry import instrument_polarity
+from ecn_tool.storage import list_tables, read_table, table_name, write_table
+
+# Columns of the results of each software read into the long table, by their name there.
+SOFTWARE_COLUMNS = {
+    'LipidSearch': {'LipidMolec': 'Annotation', 'TopRT': 'RT (min)', 'Intensity': 'Intensity'},
+    'MS-DIAL': {'Name': 'Annotation', 'RT (min)': 'RT (min)', 'Height': 'Intensity'},
+}
+# A lipid species: class and sum composition, the level both software are compared at.
+SPECIES_COLUMNS = ['Ontology', 'Carbon number', 'Double bond number']
+LONG_COLUMNS = ['Sample', 'Pair', 'Instrument', 'Polarity', 'Software', 'File', 'Ontology', 'Carbon number',
+                'Double bond number', 'Species', 'Annotation', 'Rows', 'RT (min)', 'TheorRT(min)', 'δRT(%)', 'Intensity']
+
+def sample_name(name):
+    # Sample of a result file: its name (with subfolder) without _processed, so replicates stay apart,
+    # e.g. 'QE/QE-POS-20MIN-Cell-1_processed' -> 'QE/QE-POS-20MIN-Cell-1'.
+    name = str(name)
+    return name[:-len('_processed')] if name.endswith('_processed') else name
+
+def _without_run_number(name):
+    return re.sub(r'[-_]\d+$', '', name)
+
+def pair_names(lipidsearch_names, msdial_names):
+    # {(software, name): pair} of the results of both software, the key that pairs them in overlap_stats. It is
+    # built from the file's base name (instrument, polarity and sample), so results in differently named subfolders
+    # (e.g. QE/ and QE-5%/) still pair. A number at the end of the name is left out only where it differs between
+    # the two sides: 'QE-POS-20MIN-Cell-1' and 'QE-POS-20MIN-Cell' -> 'QE-POS-20MIN-Cell', but 'Astral_POS_Cell-25'
+    # on both sides stays 'Astral_POS_Cell-25'.
+    bases = {software: {name: os.path.basename(sample_name(name)) for name in names}
+             for software, names in (('LipidSearch', lipidsearch_names), ('MS-DIAL', msdial_names))}
+    pairs = {}
+    for software, other in (('LipidSearch', 'MS-DIAL'), ('MS-DIAL', 'LipidSearch')):
+        other_bases = set(bases[other].values())
+        other_stems = {_without_run_number(base) for base in other_bases}
+        for name, base in bases[software].items():
+            stem = _without_run_number(base)
+            if base in other_bases or base in other_stems:
+                pairs[software, name] = base
+            elif stem in other_bases or stem in other_stems:
+                pairs[software, name] = stem
+            else:
+                pairs[software, name] = base
+    if bases['LipidSearch'] and bases['MS-DIAL'] and not (
+            {pairs['LipidSearch', name] for name in bases['LipidSearch']}
+            & {pairs['MS-DIAL', name] for name in bases['MS-DIAL']}):
+        print("Warning: no LipidSearch result has the instrument, polarity and sample of an MS-DIAL result, so the "
+              "overlap statistics are empty.")
+    return pairs
+
+def read_result(software, source, name, pair):
+    # One result table as rows of the long table: one row per species, the most intense if several result
+    # rows (isomers, adducts) have it, with their number in 'Rows'.
+    columns = SOFTWARE_COLUMNS[software]
+    df = read_table(source, SPECIES_COLUMNS + list(columns) + ['TheorRT(min)', 'δRT(%)']).rename(columns=columns)
+    for column in SPECIES_COLUMNS[1:]:
+        df[column] = pd.to_numeric(df[column], errors='coerce')
+    df = df.dropna(subset=SPECIES_COLUMNS)
+    df['Intensity'] = pd.to_numeric(df['Intensity'], errors='coerce').fillna(0)
+    df['Rows'] = df.groupby(SPECIES_COLUMNS)['Intensity'].transform('size')
+    df, _ = keep_max_rows(df, SPECIES_COLUMNS, 'Intensity')
+    df[SPECIES_COLUMNS[1:]] = df[SPECIES_COLUMNS[1:]].astype(int)
+    df['Ontology'] = df['Ontology'].astype(str)
+    df['Species'] = (df['Ontology'] + ' ' + df['Carbon number'].astype(str) + ':'
+                     + df['Double bond number'].astype(str))
+    instrument, polarity = instrument_polarity(name)
+    df = df.assign(Sample=sample_name(name), Pair=pair, Instrument=instrument, Polarity=polarity, Software=software,
+                   File=str(name))
+    return df[LONG_COLUMNS]
+
+def consolidate(lipidsearch=None, msdial=None, workers=1):
+    # Long table of the species found in every sample by each software, from the results of Module2-2
+    # (lipidsearch) and Module3 (msdial): {name: DataFrame or path of the _processed.xlsx file}, as returned
+    # by their main_process. Text columns are categories, so the table stays small for many samples.
+    lipidsearch, msdial = lipidsearch or {}, msdial or {}
+    pairs = pair_names(lipidsearch, msdial)
+    tasks = [(f"{software}: {name}", (software, source, name, pairs[software, name]))
+             for software, results in (('LipidSearch', lipidsearch), ('MS-DIAL', msdial))
+             for name, source in results.items()]
+    tables = []
+    for result in run_batch(read_result, tasks, workers):
+        if result.error:
+            print(f"Error reading {result.name}: {result.error}")
+        else:
+            tables.append(result.value)
+    if not tables:
+        return pd.DataFrame(columns=LONG_COLUMNS)
+    long = pd.concat(tables, ignore_index=True)
+    long = long.sort_values(['Sample', 'Software'] + SPECIES_COLUMNS, kind='stable', ignore_index=True)
+    for column in ['Sample', 'Pair', 'Instrument', 'Polarity', 'Software', 'File', 'Ontology']:
+        long[column] = long[column].astype('category')
+    return long
+
+def species_matrix(long, value='Intensity'):
+    # Species by sample: one row per species, one column per sample and software ('<sample> (<software>)').
+    index = SPECIES_COLUMNS + ['Species']
+    long = long.astype({'Sample': str, 'Software': str, 'Ontology': str})
+    # max: one value per species, sample and software even if the long table was built from several.
+    matrix = long.pivot_table(index=index, columns=['Sample', 'Software'], values=value, aggfunc='max').sort_index(axis=1)
+    matrix.columns = [f"{sample} ({software})" for sample, software in matrix.columns]
+    return matrix.reset_index()
+
+def overlap_stats(long):
+    # Species found by MS-DIAL, by LipidSearch and by both in every class of every pair of samples (see
+    # pair_names) with results of both, with the median RT difference of the species found by both; the rows
+    # of Pair 'All' add up the pairs of each class. The replicates of a pair count as one sample: a species
+    # found in any of them is found, at the RT of its most intense result.
+    long = long.astype({'Pair': str, 'Software': str, 'Ontology': str})
+    keys = ['Pair'] + SPECIES_COLUMNS
+    found = {}
+    for software in SOFTWARE_COLUMNS:
+        results = long.loc[long['Software'] == software, keys + ['RT (min)', 'Intensity']]
+        found[software] = keep_max_rows(results, keys, 'Intensity')[0].drop(columns='Intensity')
+    lipidsearch, msdial = found['LipidSearch'], found['MS-DIAL']
+    pairs = set(lipidsearch['Pair']) & set(msdial['Pair'])
+    merged = msdial[msdial['Pair'].isin(pairs)].merge(lipidsearch[lipidsearch['Pair'].isin(pairs)], on=keys,
+                                                     how='outer', suffixes=(' MS-DIAL', ' LipidSearch'),
+                                                     indicator=True)
+    merged['ΔRT (min)'] = (merged['RT (min) MS-DIAL'] - merged['RT (min) LipidSearch']).abs()
+    merged = pd.concat([merged, merged.assign(Pair='All')], ignore_index=True)
+    grouped = merged.groupby(['Pair', 'Ontology'])
+    stats = pd.crosstab([merged['Pair'], merged['Ontology']], merged['_merge'])
+    stats = stats.reindex(columns=['both', 'left_only', 'right_only'], fill_value=0)
+    stats.columns = ['Both', 'MS-DIAL only', 'LipidSearch only']
+    stats.insert(0, 'MS-DIAL', stats['Both'] + stats['MS-DIAL only'])
+    stats.insert(1, 'LipidSearch', stats['Both'] + stats['LipidSearch only'])
+    stats['Jaccard'] = (stats['Both'] / (stats['Both'] + stats['MS-DIAL only'] + stats['LipidSearch only'])).round(3)
+    stats['Median ΔRT (min)'] = grouped['ΔRT (min)'].median().reindex(stats.index).round(4)
+    stats = stats.reset_index().rename_axis(columns=None)
+    return pd.concat([stats[stats['Pair'] != 'All'], stats[stats['Pair'] == 'All']], ignore_index=True)
+
+def save_consolidated(long, path):
+    # The long table, species matrix and overlap statistics as the sheets of one Excel file (path ending in
+    # .xlsx), or as path and the <path>_matrix and <path>_overlap files next to it for .parquet.
+    tables = {'Long': long, 'Matrix': species_matrix(long), 'Overlap': overlap_stats(long)}
+    if path.endswith('.parquet'):
+        for sheet_name, table in tables.items():
+            table_path = path if sheet_name == 'Long' else f"{path[:-len('.parquet')]}_{sheet_name.lower()}.parquet"
+            write_table(table, table_path)
+    else:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with pd.ExcelWriter(path) as writer:
+            for sheet_name, table in tables.items():
+                table.to_excel(writer, sheet_name=sheet_name, index=False)
+    results = len(long[['Sample', 'Software']].drop_duplicates())
+    print(f"Consolidated {results} results of {long['Pair'].nunique()} samples, {len(long)} species rows: {path}")
+    return path
+
+def result_files(folder):
+    # {name: path} of the _processed.xlsx results of Module2-2 or Module3 in folder and its subfolders, named
+    # like their inputs.
+    if folder is None:
+        return {}
+    return {table_name(file_name)[:-len('_processed')]: os.path.join(folder, file_name)
+            for file_name in list_tables(folder, ('_processed.xlsx',))}
+
+def consolidate_folders(lipidsearch_folder, msdial_folder, output_file, workers=None):
+    # consolidate and save_consolidated over the result folders of Module2-2 and Module3 (either may be None).
+    long = consolidate(result_files(lipidsearch_folder), result_files(msdial_folder), workers)
+    save_consolidated(long, output_file)
+    return long
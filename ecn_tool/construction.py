@@ -0,0 +1,325 @@
+#Construction of ECN models (Module1-2)
+import os
+import pandas as pd
+import numpy as np
+from ecn_tool import instrument
+from ecn_tool.batch import run_batch
+from ecn_tool.fitting import OutlierFit, batch_linear_fit
+from ecn_tool.manifest import load_manifest, plan, record, save_manifest, source_sha256
+from ecn_tool.model import CARBON_RANGE_COLUMNS, MODEL_COLUMNS, format_equation, load_model, model_record, save_model
+from ecn_tool.preprocess import filter_by_max_height_chunks, process_lipid_group_key
+from ecn_tool.registry import POOLED_FOLDER, instrument_polarity
+from ecn_tool.storage import (decimal_floats, file_sha256, iter_table, read_table, table_columns, table_files,
+                              table_stem)
+
+# Columns of a training file read for a pooled model: those of an MS-DIAL export used by Module1-1, and the
+# Carbon number and Double bond number of a file Module1-1 already processed.
+POOL_COLUMNS = ['Name', 'Ontology', 'Carbon number', 'Double bond number', 'RT (min)', 'Height']
+# Columns of a training file kept once it is parsed.
+FIT_COLUMNS = ['Ontology', 'Carbon number', 'Double bond number', 'RT (min)', 'Height']
+
+def carbon_range(ontology):
+    if ontology in ['EtherLPA', 'EtherLPC', 'EtherLPE', 'EtherLPI', 'EtherLPG', 'EtherLPS',
+                    'LPA', 'LPC', 'LPE', 'LPI', 'LPG', 'LPS']:
+        return 10, 23
+    elif ontology == 'SM':
+        return 26, 50
+    elif ontology == 'TG':
+        return 30, 72
+    elif ontology in ['DG', 'EtherPA', 'EtherPC', 'EtherPE', 'EtherPI', 'EtherPG', 'EtherPS',
+                      'PA', 'PC', 'PE', 'PI', 'PG', 'PS']:
+        return 25, 48
+    return None
+def filter_x_by_ontology(ontology, x, y):
+    bounds = carbon_range(ontology)
+    if bounds is None:
+        return x, y
+    mask = (x >= bounds[0]) & (x <= bounds[1])
+    return x[mask], y[mask]
+
+def average_slopes(data):
+    # Mean slope of the linear fits over the Double bond number groups of each Ontology,
+    # with all groups of the file solved at once.
+    grouped = data.groupby(['Ontology', 'Double bond number'])
+    keys = grouped.size().index
+    codes = grouped.ngroup().to_numpy()
+    x = data['Carbon number'].to_numpy(dtype=float)
+    y = data['RT (min)'].to_numpy(dtype=float)
+    bounds = {ontology: carbon_range(ontology) or (-np.inf, np.inf) for ontology in keys.get_level_values(0).unique()}
+    low = data['Ontology'].map(lambda ontology: bounds.get(ontology, (-np.inf, np.inf))[0]).to_numpy(dtype=float)
+    high = data['Ontology'].map(lambda ontology: bounds.get(ontology, (-np.inf, np.inf))[1]).to_numpy(dtype=float)
+    codes = np.where((x >= low) & (x <= high) & np.isfinite(y), codes, -1)
+    slopes, _, counts = batch_linear_fit(codes, x, y, len(keys))
+    slopes = pd.Series(slopes, index=keys)[(counts >= 2) & np.isfinite(slopes)]
+    return slopes.groupby(level=0).mean().to_dict()
+
+def process_excel(file_path, output_folder, data=None, workers=1):
+    # data: optional DataFrame already in memory; file_path then only names the model file.
+    # workers: number of processes the (Ontology, Double bond number) groups are fitted in (see fit_groups).
+    source_hash = file_sha256(file_path) if data is None else data.attrs.get('sha256')
+    if data is None:
+        with instrument.step('read') as counts:
+            data = read_table(file_path)
+            counts['rows_out'] = len(data)
+    else:
+        data = data.copy()
+    # RT read as float32 from a text export is fitted at the precision it was exported with.
+    data = decimal_floats(data)
+    columns = ['Ontology', 'Double bond number', 'Carbon number', 'RT (min)']
+    if not all(col in data.columns for col in columns):
+        print(f"File {os.path.basename(file_path)} is missing columns and has been skipped.")
+        return pd.DataFrame()
+
+    # Data cleansing: ensure that the 'Carbon number' column contains only numbers.
+    data['Carbon number'] = pd.to_numeric(data['Carbon number'], errors='coerce')
+    rows_in = len(data)
+    data = data.dropna(subset=['Carbon number'])
+    instrument.dropped('Carbon number dropna', rows_in, len(data))
+    data['Carbon number'] = data['Carbon number'].astype(float)
+    with instrument.step('fit', len(data)) as counts:
+        results = fit_groups(data, workers)
+        counts['rows_out'] = len(results)
+    output_file = model_path(output_folder, table_stem(file_path))
+    if results:
+        os.makedirs(output_folder, exist_ok=True)
+        results_df = pd.DataFrame(results, columns=MODEL_COLUMNS)
+        with instrument.step('write', len(results_df)):
+            results_df.to_excel(output_file, sheet_name='Fit Results', index=False)
+            # Full-precision coefficients and fit diagnostics, read directly by Module2-2 and Module3.
+            records = [model_record(result['Ontology'], result['Double bond number'], result['Fit Type'],
+                                    result['Coefficients'], result['r2'], result['X_R_data'], result['Y_R_data'])
+                       for result in results]
+            save_model(output_file[:-len('.xlsx')] + '.json', records, os.path.basename(file_path), source_hash)
+        # The model returned also holds the fitted carbon range of each equation, as the JSON model does.
+        results_df[CARBON_RANGE_COLUMNS] = [[record['carbon_min'], record['carbon_max']] for record in records]
+        print(f"Processed: {os.path.basename(file_path)}, saved: {output_file}")
+        return results_df
+    else:
+        print(f"No fitting results for: {os.path.basename(file_path)}")
+        return pd.DataFrame()
+
+def fit_groups(data, workers=1):
+    # The accepted fit of every (Ontology, Double bond number) group of the training data, in two phases:
+    # the mean slope of each Ontology (one pass over all groups), then the slope-constrained fit of each group,
+    # spread over workers processes (None: all cores, 1: serial). Results are in Ontology, Double bond number
+    # order whatever the number of workers.
+    avg_slopes = average_slopes(data)
+    groups = []
+    for (ontology, db), group in data.groupby(['Ontology', 'Double bond number']):
+        x = np.array(group['Carbon number'].values, dtype=float)
+        y = np.array(group['RT (min)'].values, dtype=float)
+        groups.append((ontology, db, x, y, avg_slopes.get(ontology)))
+    if workers is None:
+        workers = os.cpu_count() or 1
+    # The groups go to the processes in a few runs of consecutive groups each rather than one by one,
+    # as a single fit takes less time than sending it to a process.
+    size = max(1, -(-len(groups) // (workers * 4)))
+    tasks = [(groups[i][:2], (groups[i:i + size],)) for i in range(0, len(groups), size)]
+    results = []
+    for result in run_batch(fit_chunk, tasks, workers, labelled=False):
+        if result.error:
+            raise RuntimeError(f"Fitting the groups from {result.name} failed:\n{result.error}")
+        for fit, event in result.value:
+            if event is None:
+                continue
+            if fit is not None:
+                results.append(fit)
+            instrument.record('fit', **event)
+    return results
+
+def fit_chunk(groups):
+    return [fit_group(*group) for group in groups]
+
+def fit_group(ontology, db, x, y, avg_slope):
+    # Fit of one group against the mean slope of its Ontology: (result or None if no fit was accepted, the
+    # fit event for instrument), or (None, None) for a group that is not fitted at all.
+    x_filtered, y_filtered = filter_x_by_ontology(ontology, x, y)
+    if len(x_filtered) < 2:
+        return None, None
+    # Initial linear fitting
+    try:
+        fit = OutlierFit(x_filtered, y_filtered)
+        popt_linear, residuals_linear, r2_linear = fit.linear()
+        if avg_slope and abs(popt_linear[0] - avg_slope) > 0.6:  # Slope constraint
+            return None, None
+    except ValueError:
+        return None, None
+    # Failed to fit linear equation, used raw data to fit quadratic equations.
+    r2_quad = 0
+    if len(fit) >= 3:
+        popt_quad, residuals_quad, r2_quad = fit.quadratic()
+    # Remove outliers and refit on the remaining points.
+    iterations = 0
+    while (r2_quad < 0.99 and r2_linear < 0.99) and len(fit) > 2:
+        iterations += 1
+        residuals = residuals_quad if r2_quad < r2_linear else residuals_linear
+        fit.remove(np.argmax(np.abs(residuals)))
+        # Update the linear fit and relax the linear constraints
+        popt_linear, residuals_linear, r2_linear = fit.linear()
+        if avg_slope and abs(popt_linear[0] - avg_slope) > 0.6:
+            r2_linear = 0
+        # Update the quadratic equations fitting.
+        if len(fit) >= 3:
+            popt_quad, residuals_quad, r2_quad = fit.quadratic()
+        else:
+            r2_quad = 0
+    x_filtered_quad, y_filtered_quad = fit.x, fit.y
+    fit_data = {
+        'Ontology': ontology,
+        'Double bond number': db,
+        'X_data': x,
+        'Y_data': y,
+        'X_R_data': x_filtered_quad,
+        'Y_R_data': y_filtered_quad}
+    result = None
+    if r2_linear >= 0.99 and avg_slope and abs(popt_linear[0] - avg_slope) <= 0.6:
+        coefficients = (0.0, popt_linear[0], popt_linear[1])
+        Equation = format_equation('Linear', coefficients)
+        result = {**fit_data, 'Fit Type': 'Linear', 'Equation': Equation, 'R^2': round(r2_linear, 3),
+                  'Coefficients': coefficients, 'r2': r2_linear}
+    elif r2_quad >= 0.99:
+        coefficients = tuple(popt_quad)
+        Equation = format_equation('Quadratic', coefficients)
+        result = {**fit_data, 'Fit Type': 'Quadratic', 'Equation': Equation, 'R^2': round(r2_quad, 3),
+                  'Coefficients': coefficients, 'r2': r2_quad}
+    # fit_type None: the group got no accepted fit.
+    event = {'ontology': ontology, 'double_bond': db, 'points': len(x_filtered), 'iterations': iterations,
+             'fit_type': None if result is None else result['Fit Type']}
+    return result, event
+
+def model_path(output_folder, name):
+    return os.path.join(output_folder, name + '_processed.xlsx')
+
+def read_model(output_file):
+    # A model written by process_excel, as it returned it: with the fitted carbon ranges of its JSON model.
+    model = read_table(output_file)
+    json_file = output_file[:-len('.xlsx')] + '.json'
+    if os.path.exists(json_file):
+        ranges = load_model(json_file)
+        if len(ranges) == len(model):
+            model[CARBON_RANGE_COLUMNS] = ranges[CARBON_RANGE_COLUMNS].to_numpy()
+    return model
+
+def process_folder(input_folder, output_folder, frames=None, workers=None, incremental=True):
+    # frames: optional {name: DataFrame or path} from Module1-1, used instead of reading input_folder.
+    # workers: number of processes the files are spread over (None: all cores, 1: serial).
+    # incremental: a model whose training data has not changed since it was built is read back instead of refitted.
+    if not os.path.exists(output_folder):
+        os.makedirs(output_folder)
+    if frames is None:
+        frames = table_files(input_folder)
+    manifest = load_manifest(output_folder) if incremental else None
+    keys, cached = plan(manifest, output_folder, 'construction', frames)
+    models = {name: read_model(outputs[0]) for name, outputs in cached.items()}
+    # Several files are fitted side by side, one per process; a single file has its groups spread over the
+    # processes instead.
+    group_workers = workers if len(keys) == 1 else 1
+    tasks = []
+    for name in keys:
+        source = frames[name]
+        # Models are written next to each other in the subfolder layout of the training data.
+        model_folder = os.path.join(output_folder, os.path.dirname(name))
+        if isinstance(source, pd.DataFrame):
+            tasks.append((name, (name + '.xlsx', model_folder, source, group_workers)))
+        else:
+            tasks.append((name, (source, model_folder, None, group_workers)))
+    for result in run_batch(process_excel, tasks, 1 if len(keys) == 1 else workers):
+        if result.error:
+            print(f"Error processing {result.name}: {result.error}")
+        elif not result.value.empty:
+            models[result.name] = result.value
+            output_file = model_path(output_folder, result.name)
+            record(manifest, output_folder, result.name, keys[result.name],
+                   [output_file, output_file[:-len('.xlsx')] + '.json'])
+    if manifest is not None:
+        save_manifest(manifest, output_folder)
+    return {name: models[name] for name in frames if name in models}
+
+def training_chunks(sources, chunk_rows=None):
+    # The rows of the training files sources (paths or DataFrames), parsed by Module1-1 if they were not yet and
+    # cut down to FIT_COLUMNS, one file (or chunk_rows rows of it) at a time. Rows are labelled by their position
+    # over all files, as keep_max_rows_chunks requires.
+    start = 0
+    for source in sources:
+        available = source.columns if isinstance(source, pd.DataFrame) else table_columns(source)
+        columns = [column for column in POOL_COLUMNS if column in available]
+        if not {'Ontology', 'RT (min)', 'Height'} <= set(columns) or not {'Name', 'Carbon number'} & set(columns):
+            print(f"Training file {source if isinstance(source, str) else ''} is missing columns and has been skipped.")
+            continue
+        chunks = iter_table(source, chunk_rows, columns) if chunk_rows else [read_table(source, columns)]
+        for chunk in chunks:
+            if 'Carbon number' not in chunk.columns:
+                chunk = process_lipid_group_key(chunk)
+            # RT and Height of a text export are kept at the precision they were exported with.
+            chunk = decimal_floats(chunk[FIT_COLUMNS])
+            chunk.index = pd.RangeIndex(start, start + len(chunk))
+            start += len(chunk)
+            yield chunk
+
+def pool_training(sources, chunk_rows=None):
+    # The species of all training files, each at its max-Height row over all of them (as Module1-1 does within
+    # one file). Only the rows kept so far and one file (or chunk) are in memory at a time, so memory is bounded
+    # by the number of species, not by the number of files or rows.
+    with instrument.step('read+parse+dedup') as counts:
+        pooled = filter_by_max_height_chunks(instrument.counted(training_chunks(sources, chunk_rows), counts))
+        counts['rows_out'] = len(pooled)
+    if counts['rows_in']:
+        instrument.dropped('max Height per species', counts['rows_in'], len(pooled))
+    return pooled
+
+def process_pooled(name, sources, output_folder, chunk_rows=None, workers=1):
+    # One ECN model, <name>_processed.xlsx and .json in output_folder, fitted once on the union of the training
+    # files sources {file name: path or DataFrame}; workers: processes the groups are fitted in.
+    pooled = pool_training(list(sources.values()), chunk_rows)
+    if pooled.empty:
+        print(f"No training data for the pooled model {name}.")
+        return pd.DataFrame()
+    print(f"Pooled {len(sources)} training files into {len(pooled)} species for {name}")
+    pooled.attrs['sha256'] = source_sha256(list(sources.values()))
+    return process_excel(name + '.xlsx', output_folder, pooled, workers)
+
+def pooled_groups(frames, by_instrument=True):
+    # {model name: {file name: source}}: the training files of each pooled model, one model per instrument and
+    # polarity found in the file names (e.g. 'QE-POS-pooled'), or a single model 'pooled' if by_instrument is False.
+    if not by_instrument:
+        return {'pooled': dict(frames)}
+    groups = {}
+    for name, source in frames.items():
+        instrument_name, polarity = instrument_polarity(name)
+        if instrument_name is None or polarity is None:
+            print(f"Skipped {name}: its name gives no instrument or polarity to pool it by.")
+        else:
+            groups.setdefault(f"{instrument_name}-{polarity}-pooled", {})[name] = source
+    return dict(sorted(groups.items()))
+
+def process_pooled_folder(input_folder, output_folder, frames=None, workers=None, incremental=True, chunk_rows=None,
+                          by_instrument=True):
+    # Pooled models (see pooled_groups) over the MS-DIAL training files of input_folder (Module1-input-MSDIAL, or
+    # Module1-output-1) and its subfolders, or over frames {name: DataFrame or path}. They are written to the
+    # pooled subfolder of output_folder (see registry.POOLED_FOLDER), apart from the models of single files.
+    # incremental: a model whose training files have not changed since it was built is read back instead.
+    # chunk_rows: also read each training file in batches of this many rows.
+    # Returns {model name: model DataFrame}.
+    output_folder = os.path.join(output_folder, POOLED_FOLDER)
+    os.makedirs(output_folder, exist_ok=True)
+    if frames is None:
+        frames = table_files(input_folder)
+    groups = pooled_groups(frames, by_instrument)
+    manifest = load_manifest(output_folder) if incremental else None
+    keys, cached = plan(manifest, output_folder, 'construction-pooled',
+                        {name: list(sources.values()) for name, sources in groups.items()})
+    models = {name: read_model(outputs[0]) for name, outputs in cached.items()}
+    # As in process_folder: several models side by side, or the groups of a single model over the processes.
+    group_workers = workers if len(keys) == 1 else 1
+    tasks = [(name, (name, groups[name], output_folder, chunk_rows, group_workers)) for name in keys]
+    for result in run_batch(process_pooled, tasks, 1 if len(keys) == 1 else workers):
+        if result.error:
+            print(f"Error processing {result.name}: {result.error}")
+        elif not result.value.empty:
+            models[result.name] = result.value
+            output_file = model_path(output_folder, result.name)
+            record(manifest, output_folder, result.name, keys[result.name],
+                   [output_file, output_file[:-len('.xlsx')] + '.json'])
+    if manifest is not None:
+        save_manifest(manifest, output_folder)
+    return {name: models[name] for name in groups if name in models}
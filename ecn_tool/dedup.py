@@ -0,0 +1,39 @@
+#Vectorized keep-the-maximum deduplication shared by the modules
+import numpy as np
+import pandas as pd
+
+def keep_max_rows(df, keys, value, keep_ties=False):
+    # Keep the row with the largest `value` in every group of `keys`; rows with a missing key are dropped.
+    # keep_ties=True keeps every row equal to the group maximum (and single-row groups as they are),
+    # keep_ties=False keeps the first maximum as idxmax does.
+    # Rows come out group by group in sorted key order, in their original order within a group.
+    # Returns (kept rows, duplicates), duplicates holding the keys, row count and maximum of every group
+    # with more than one row. Categorical keys give only the groups that have rows, on every pandas version.
+    grouped = df.groupby(keys, sort=True, observed=True, dropna=True)
+    if keep_ties:
+        size = grouped[value].transform('size')
+        keep = ((df[value] == grouped[value].transform('max')) | (size == 1)).to_numpy()
+        group_number = grouped.ngroup().to_numpy()[keep]
+        kept = df[keep].iloc[np.argsort(group_number, kind='stable')]
+    else:
+        kept = df.loc[grouped[value].idxmax().to_numpy()]
+    stats = grouped[value].agg(['size', 'max'])
+    duplicates = stats[stats['size'] > 1].rename(columns={'size': 'Rows', 'max': f'Max {value}'}).reset_index()
+    return kept, duplicates
+
+def keep_max_rows_chunks(chunks, keys, value, keep_ties=False):
+    # keep_max_rows over the concatenation of chunks (with distinct row labels, see storage.iter_table),
+    # holding only the rows kept so far and the next chunk in memory: a row dropped within part of the data
+    # can never be kept for the whole of it. Returns (None, None) if there was no chunk.
+    kept, stats = None, None
+    for chunk in chunks:
+        kept, _ = keep_max_rows(chunk if kept is None else pd.concat([kept, chunk]), keys, value, keep_ties)
+        chunk_stats = chunk.groupby(keys, sort=True, observed=True, dropna=True)[value].agg(['size', 'max'])
+        if stats is not None:
+            chunk_stats = pd.concat([stats, chunk_stats]).groupby(level=list(range(len(keys))), sort=True,
+                                                                 observed=True).agg({'size': 'sum', 'max': 'max'})
+        stats = chunk_stats
+    if kept is None:
+        return None, None
+    duplicates = stats[stats['size'] > 1].rename(columns={'size': 'Rows', 'max': f'Max {value}'}).reset_index()
+    return kept, duplicates
@@ -0,0 +1,78 @@
+#Closed-form least-squares fits used to build the ECN models
+import numpy as np
+
+def _r2(y, residuals):
+    return 1 - (np.sum(residuals ** 2) / np.sum((y - np.mean(y)) ** 2))
+
+def _check_finite(x, y):
+    if not (np.all(np.isfinite(x)) and np.all(np.isfinite(y))):
+        raise ValueError("Carbon number and RT must be finite to fit an ECN model")
+
+def batch_linear_fit(group_codes, x, y, n_groups):
+    # Slope, intercept and point count of y = a*x + b for every group at once.
+    # group_codes: group number of each point (-1 excludes the point).
+    keep = group_codes >= 0
+    codes, x, y = group_codes[keep], x[keep], y[keep]
+    n = np.bincount(codes, minlength=n_groups).astype(float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        x_mean = np.bincount(codes, weights=x, minlength=n_groups) / n
+        y_mean = np.bincount(codes, weights=y, minlength=n_groups) / n
+        dx = x - x_mean[codes]
+        sxx = np.bincount(codes, weights=dx * dx, minlength=n_groups)
+        sxy = np.bincount(codes, weights=dx * (y - y_mean[codes]), minlength=n_groups)
+        slope = np.where(sxx > 0, sxy / sxx, np.nan)
+    return slope, y_mean - slope * x_mean, n.astype(int)
+
+class OutlierFit:
+    # Linear and quadratic least-squares fits of one (Ontology, DB) group in the centred carbon numbers.
+    # Both fits share one design matrix; removing a point drops its row, and every fit is solved by an
+    # orthogonal factorization of the remaining rows (np.linalg.lstsq), which keeps the coefficients to
+    # rounding error of those of a fresh fit on the same points.
+    def __init__(self, x, y):
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        _check_finite(x, y)
+        self._x, self._y = x, y
+        self._active = np.ones(len(x), dtype=bool)
+        self._shift = x.mean() if len(x) else 0.0
+        t = x - self._shift
+        self._design = np.stack([np.ones_like(t), t, t * t], axis=1)
+
+    @property
+    def x(self):
+        return self._x[self._active]
+
+    @property
+    def y(self):
+        return self._y[self._active]
+
+    def __len__(self):
+        return int(self._active.sum())
+
+    def remove(self, index):
+        # index: position among the points still in the fit, as in np.delete.
+        self._active[np.flatnonzero(self._active)[index]] = False
+
+    def _solve(self, size):
+        return np.linalg.lstsq(self._design[self._active, :size], self.y, rcond=None)[0]
+
+    def linear(self):
+        # (a, b) of y = a*x + b, residuals and R^2 on the remaining points.
+        if len(self) < 2:
+            raise ValueError("A linear fit needs at least 2 points")
+        c0, c1 = self._solve(2)
+        popt = np.array([c1, c0 - c1 * self._shift])
+        x, y = self.x, self.y
+        residuals = y - (popt[0] * x + popt[1])
+        return popt, residuals, _r2(y, residuals)
+
+    def quadratic(self):
+        # (a, b, c) of y = a*x^2 + b*x + c, residuals and R^2 on the remaining points.
+        if len(self) < 3:
+            raise ValueError("A quadratic fit needs at least 3 points")
+        c0, c1, c2 = self._solve(3)
+        s = self._shift
+        popt = np.array([c2, c1 - 2 * c2 * s, c0 - c1 * s + c2 * s * s])
+        x, y = self.x, self.y
+        residuals = y - (popt[0] * x ** 2 + popt[1] * x + popt[2])
+        return popt, residuals, _r2(y, residuals)
@@ -0,0 +1,227 @@
+#Instrumentation of the stages: step timers, row counts, rows dropped by each filter, fit iterations and peak memory
+import contextlib
+import json
+import os
+import sys
+import time
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+PROFILERS = ('cprofile', 'pyinstrument')
+# Settings of this process, None while instrumentation is off: the stages then only pay for a None check.
+_config = None
+_events = []
+# Stage and file of the task running in this process (see batch.run_batch), added to every event it records.
+_labels = {}
+# Peak RSS (MB) so far of every step open in this process, innermost last (see step).
+_open_peaks = []
+_resettable_peak = sys.platform.startswith('linux')
+# Largest peak RSS (MB) taken by _take_peak_mb in this process.
+_taken_peak = 0.0
+
+def enable(profiler=None, profile_dir='profiles', profile_stages=None):
+    # Starts recording events, dropping those of an earlier run.
+    # profiler: also profile every task with 'cprofile' or 'pyinstrument', saved as
+    # profile_dir/<stage>/<file>.prof or .html; profile_stages: the stages to profile (e.g. ['construction']), None for all.
+    if profiler is not None and profiler not in PROFILERS:
+        raise ValueError(f"Unsupported profiler '{profiler}', expected one of {list(PROFILERS)}")
+    configure({'profiler': profiler, 'profile_dir': profile_dir,
+               'profile_stages': None if profile_stages is None else list(profile_stages)})
+
+def disable():
+    configure(None)
+
+def config():
+    return _config
+
+def configure(config):
+    # Applies the settings of config() in another process (a batch worker), with no events recorded yet.
+    global _config
+    _config = config
+    _events.clear()
+    _labels.clear()
+    _open_peaks.clear()
+
+def enabled():
+    return _config is not None
+
+def process_peak_rss_mb():
+    # Peak RSS of the process since it started (it never goes down), in MB; None where unavailable.
+    # The peaks taken by _take_peak_mb count too: resetting VmHWM also resets ru_maxrss.
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak = peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+    return max(peak, _taken_peak)
+
+def _take_peak_mb():
+    # Peak RSS since the last call, in MB, from VmHWM, which is then reset to the current RSS (Linux only);
+    # None where the peak cannot be reset.
+    global _resettable_peak, _taken_peak
+    if not _resettable_peak:
+        return None
+    try:
+        with open('/proc/self/status') as f:
+            peak = next(int(line.split()[1]) for line in f if line.startswith('VmHWM:'))
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except (OSError, StopIteration, ValueError):
+        _resettable_peak = False
+        return None
+    _taken_peak = max(_taken_peak, peak / 1024)
+    return peak / 1024
+
+def _fold_peak():
+    # Adds the peak RSS since the last reset to every open step, so a step's peak includes its inner steps.
+    peak = _take_peak_mb()
+    if peak is not None:
+        _open_peaks[:] = [max(open_peak, peak) for open_peak in _open_peaks]
+    return peak is not None
+
+def record(event, **fields):
+    if _config is not None:
+        _events.append({'event': event, **_labels, **fields})
+
+def dropped(filter_name, rows_in, rows_out):
+    # Rows removed by one filter of a stage (e.g. the adduct filter of Module2-1).
+    record('filter', filter=filter_name, rows_in=rows_in, rows_out=rows_out, dropped=rows_in - rows_out)
+
+@contextlib.contextmanager
+def step(name, rows_in=None):
+    # Times the block as one step of the current task. The block may set 'rows_in' and 'rows_out' on the
+    # yielded dict, e.g. `with step('read') as counts: df = ...; counts['rows_out'] = len(df)`.
+    # peak_rss_mb is the peak RSS during the step (Linux only, None elsewhere); process_peak_rss_mb is that of
+    # the process up to the end of the step, including earlier steps and files.
+    counts = {'rows_in': rows_in, 'rows_out': None}
+    if _config is None:
+        yield counts
+        return
+    measured = _fold_peak()
+    if measured:
+        _open_peaks.append(0.0)
+    start = time.perf_counter()
+    try:
+        yield counts
+    finally:
+        seconds = time.perf_counter() - start
+        peak = None
+        if measured:
+            _fold_peak()
+            peak = _open_peaks.pop()
+        record('step', step=name, seconds=seconds, **counts, peak_rss_mb=peak,
+               process_peak_rss_mb=process_peak_rss_mb())
+
+def counted(chunks, counts, key='rows_in'):
+    # The chunks, with their total row count kept in counts[key] (for steps over a chunked input).
+    counts[key] = counts.get(key) or 0
+    for chunk in chunks:
+        counts[key] += len(chunk)
+        yield chunk
+
+def _start_profiler(stage):
+    stages = _config['profile_stages']
+    if _config['profiler'] is None or (stages is not None and stage not in stages):
+        return None
+    if _config['profiler'] == 'pyinstrument':
+        try:
+            import pyinstrument
+        except ImportError:
+            raise ImportError("Profiling with pyinstrument requires the 'pyinstrument' package (pip install pyinstrument).")
+        profiler = pyinstrument.Profiler()
+    else:
+        import cProfile
+        profiler = cProfile.Profile()
+    profiler.start() if _config['profiler'] == 'pyinstrument' else profiler.enable()
+    return profiler
+
+def _save_profile(profiler, stage, name):
+    extension = '.html' if _config['profiler'] == 'pyinstrument' else '.prof'
+    path = os.path.join(_config['profile_dir'], stage, str(name) + extension)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if _config['profiler'] == 'pyinstrument':
+        profiler.stop()
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(profiler.output_html())
+    else:
+        profiler.disable()
+        profiler.dump_stats(path)
+
+@contextlib.contextmanager
+def task(stage, name):
+    # One file of a stage: labels the events recorded in the block, times it as the step 'total' and
+    # profiles it if enabled.
+    if _config is None:
+        yield
+        return
+    _labels.update(stage=stage, file=name)
+    profiler = _start_profiler(stage)
+    try:
+        with step('total'):
+            yield
+    finally:
+        if profiler is not None:
+            _save_profile(profiler, stage, name)
+        _labels.clear()
+
+def collect():
+    # The events recorded so far, removed from this process (sent back by batch workers).
+    events = list(_events)
+    _events.clear()
+    return events
+
+def extend(events):
+    if _config is not None:
+        _events.extend(events)
+
+def events():
+    return list(_events)
+
+def _json_value(value):
+    # numpy scalars (e.g. a Double bond number) as plain numbers, anything else as text.
+    return value.item() if hasattr(value, 'item') else str(value)
+
+def write_jsonl(path, recorded=None):
+    recorded = events() if recorded is None else recorded
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        for event in recorded:
+            f.write(json.dumps(event, default=_json_value, ensure_ascii=False) + '\n')
+    return path
+
+def summary(recorded=None):
+    # Tables of the recorded events: 'steps' (time, rows and peak memory per stage and step), 'filters'
+    # (rows dropped per stage and filter) and 'fits' (fitted groups and outlier-removal iterations per stage).
+    df = pd.DataFrame(events() if recorded is None else recorded)
+    tables = {}
+    if df.empty:
+        return tables
+    df = df.reindex(columns=sorted(set(df.columns) | {'stage', 'file'}))
+    if (df['event'] == 'step').any():
+        steps = df[df['event'] == 'step']
+        tables['steps'] = steps.groupby(['stage', 'step'], sort=False, dropna=False).agg(
+            files=('file', 'nunique'), rows_in=('rows_in', lambda rows: rows.sum(min_count=1)),
+            rows_out=('rows_out', lambda rows: rows.sum(min_count=1)), seconds=('seconds', 'sum'),
+            peak_rss_mb=('peak_rss_mb', 'max'))
+    if (df['event'] == 'filter').any():
+        filters = df[df['event'] == 'filter']
+        tables['filters'] = filters.groupby(['stage', 'filter'], sort=False, dropna=False).agg(
+            files=('file', 'nunique'), rows_in=('rows_in', 'sum'), dropped=('dropped', 'sum'))
+    if (df['event'] == 'fit').any():
+        fits = df[df['event'] == 'fit']
+        tables['fits'] = fits.groupby(['stage', 'file'], sort=False, dropna=False).agg(
+            groups=('fit_type', 'size'), fitted=('fit_type', 'count'), iterations=('iterations', 'sum'),
+            max_iterations=('iterations', 'max'))
+    return tables
+
+def report(path=None):
+    # Writes the recorded events to path as JSON lines, or prints the summary tables if path is None.
+    if path:
+        write_jsonl(path)
+        print(f"Saved {len(_events)} instrumentation events to {path}")
+        return
+    for name, table in summary().items():
+        print(f"\n{name}:\n{table.to_string(float_format=lambda value: f'{value:.3f}')}")
@@ -0,0 +1,45 @@
+#Lipid name grammar shared by all modules (MS-DIAL Name, LipidSearch LipidGroupKey/LipidMolec)
+import re
+import pandas as pd
+
+# First 'carbon:double bond' pair, e.g. 'PC 34:1', 'PC(16:0_18:1)', 'Cer 18:1;O2/16:0'.
+SPECIES_PATTERN = re.compile(r'(\d+):(\d+)')
+# Ether-linked chain: 'PC O-34:1', 'PE P-18:0_20:4', 'PC(O-18:2_22:5)'.
+ETHER_PATTERN = re.compile(r'(?<![A-Za-z0-9])[OP]-\d')
+# Extra-oxygen annotation: ';O', ';2O', ';O2', '+O', '(OH)'.
+OXIDIZED_PATTERN = re.compile(r';\d*O\d*\b|\+\d*O\b|\(OH\)')
+FIELDS = ['Carbon number', 'Double bond number', 'Ether', 'Oxidized', 'Chains']
+_EMPTY = (None, None, False, False, None)
+_MAX_CACHED = 200000
+_cache = {}
+
+def _parse_new(names):
+    species = names.str.extract(SPECIES_PATTERN)
+    carbon = pd.to_numeric(species[0]).astype('Int64')
+    double_bond = pd.to_numeric(species[1]).astype('Int64')
+    ether = names.str.contains(ETHER_PATTERN)
+    oxidized = names.str.contains(OXIDIZED_PATTERN)
+    # Acyl chains: text inside the last '(...)', split on '_' and sorted, e.g. 'TG(18:1_16:0_18:1)'.
+    has_parens = names.str.contains('(', regex=False) & names.str.contains(')', regex=False)
+    content = names.str.rsplit('(', n=1).str[-1].str.split(')', n=1).str[0]
+    chains = [tuple(sorted(text.split('_'))) if parens else None for text, parens in zip(content, has_parens)]
+    return {name: (None if pd.isna(c) else int(c), None if pd.isna(d) else int(d), bool(e), bool(o), t)
+            for name, c, d, e, o, t in zip(names, carbon, double_bond, ether, oxidized, chains)}
+
+def parse_names(names):
+    # One row per name with FIELDS: Int64 carbon and double bond numbers (<NA> without a 'C:DB' pair),
+    # Ether/Oxidized flags and the sorted Chains tuple (None without parentheses).
+    # Every distinct name is parsed once and remembered for later files.
+    names = pd.Series(names)
+    codes, uniques = pd.factorize(names)
+    new = [name for name in uniques if isinstance(name, str) and name not in _cache]
+    if len(_cache) + len(new) > _MAX_CACHED:
+        _cache.clear()
+        new = [name for name in uniques if isinstance(name, str)]
+    if new:
+        _cache.update(_parse_new(pd.Series(new, dtype=object)))
+    rows = [_cache.get(name, _EMPTY) if isinstance(name, str) else _EMPTY for name in uniques]
+    # Code -1 (missing name) picks the trailing empty row.
+    table = pd.DataFrame(rows + [_EMPTY], columns=FIELDS).iloc[codes]
+    table.index = names.index
+    return table.astype({'Carbon number': 'Int64', 'Double bond number': 'Int64', 'Ether': bool, 'Oxidized': bool})
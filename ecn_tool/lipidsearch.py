@@ -0,0 +1,230 @@
+#Application of ECN model in lipid annotation using LipidSearch (Module2-2)
+import os
+import pandas as pd
+import numpy as np
+from ecn_tool import instrument
+from ecn_tool.batch import run_batch
+from ecn_tool.dedup import keep_max_rows
+from ecn_tool.lipid_names import parse_names
+from ecn_tool.matching import TOLERANCE_UNITS, RTGrid, delta_rt, match_table, within_tolerance
+from ecn_tool.model import add_coefficients, load_model, parse_equation, theoretical_rt
+from ecn_tool.manifest import load_manifest, plan, record, save_manifest
+from ecn_tool.registry import select_models
+from ecn_tool.storage import decimal_floats, iter_table, read_table, table_files
+def process_lipid_group_key(df):
+    if 'LipidGroupKey' in df.columns:
+        parsed = parse_names(df['LipidGroupKey'])
+        df.insert(df.columns.get_loc('LipidGroupKey') + 1, 'Carbon number', parsed['Carbon number'])
+        df.insert(df.columns.get_loc('Carbon number') + 1, 'Double bond number', parsed['Double bond number'])
+    return df
+
+def solve_Equation(Equation, carbon_number_value):
+    try:
+        a, b, c = parse_equation(Equation)
+    except ValueError as e:
+        print(f"Error parsing Equation {Equation}: {e}")
+        return np.nan
+    return theoretical_rt(a, b, c, carbon_number_value)
+
+def read_index_table(index_file):
+    # index_file: path of the ECN model file (.json or .xlsx), or the model DataFrame returned by Module1-2.
+    if isinstance(index_file, str) and index_file.endswith('.json'):
+        return load_model(index_file).dropna(subset=['Ontology'])
+    index_table = read_table(index_file)
+    index_table.columns = index_table.columns.str.strip()
+    if 'Ontology' not in index_table.columns:
+        print("Error: Index table lacks 'Ontology' column. Skipping further processing.")
+        return pd.DataFrame()
+    if 'Equation' not in index_table.columns:
+        print("Error: Index table lacks 'Equation' column. Skipping further processing.")
+        return pd.DataFrame()
+    index_table = index_table.dropna(subset=['Ontology'])
+    # Parse the equations once; TheorRT is then evaluated for all matched rows at once.
+    return add_coefficients(index_table)
+
+def process_excel_step2(input_file, index_table, tolerance=5.0, tolerance_unit='%', grid=None):
+    # Rows of the input matched to the ECN equation of their (Ontology, Double bond number) within tolerance
+    # (in % of TopRT or in minutes); grid: the RTGrid of index_table, built here if not given.
+    if index_table.empty:
+        print("Index table is empty. Skipping file:", input_file)
+        return pd.DataFrame()
+    try:
+        with instrument.step('read') as counts:
+            df_input = read_table(input_file)
+            counts['rows_out'] = rows_in = len(df_input)
+        df_input = df_input.dropna(subset=['Ontology'])
+        instrument.dropped('Ontology dropna', rows_in, len(df_input))
+        if df_input.empty:
+            print(f"File {input_file} contains no valid data after filtering 'Ontology'. Skipping file.")
+            return pd.DataFrame()
+        df_input = process_lipid_group_key(df_input)
+        df_input['Ontology'] = df_input['Ontology'].astype(str)
+        df_input['Double bond number'] = pd.to_numeric(df_input['Double bond number'], errors='coerce').fillna(
+            0).astype(int)
+        df_input['Carbon number'] = pd.to_numeric(df_input['Carbon number'], errors='coerce').fillna(0).astype(int)
+        # Rows outside the tolerance window are never joined to the model.
+        with instrument.step('match', len(df_input)) as counts:
+            full_match = match_table(df_input, grid if grid is not None else RTGrid(index_table), 'TopRT', tolerance,
+                                     tolerance_unit)
+            counts['rows_out'] = len(full_match)
+        full_match['δRT(%)'] = delta_rt(full_match['TopRT'], full_match['TheorRT(min)'])
+        full_match['TheorRT(min)'] = full_match['TheorRT(min)'].round(2)
+        full_match['δRT(%)'] = full_match['δRT(%)'].round(2)
+        return full_match
+    except Exception as e:
+        # Raised again, so the batch counts the file as failed instead of as a file without matches.
+        print(f"File {input_file} processing failed with error: {e}")
+        raise
+
+def within_window(sheet_data, tolerance=5.0, tolerance_unit='%'):
+    #Filter data with δRT(%) >-5 and <5, or within another tolerance in % or minutes
+    if tolerance_unit == 'min':
+        return sheet_data[within_tolerance(sheet_data['TopRT'], sheet_data['TheorRT(min)'], tolerance, 'min')]
+    return sheet_data[(sheet_data['δRT(%)'] > -tolerance) & (sheet_data['δRT(%)'] < tolerance)]
+
+def smallest_delta(filtered_data):
+    # Select the smallest value of δRT (%) in each LipidMolec subgroup.
+    return filtered_data.loc[filtered_data.groupby("LipidMolec")['δRT(%)'].idxmin()]
+
+def filter_matches(dataframe, tolerance=5.0, tolerance_unit='%'):
+    sheet_data = dataframe
+    if "δRT(%)" in sheet_data.columns and "LipidMolec" in sheet_data.columns:
+        window = within_window(sheet_data, tolerance, tolerance_unit)
+        instrument.dropped('δRT window', len(sheet_data), len(window))
+        processed_data = smallest_delta(window).reset_index(drop=True)
+        instrument.dropped('smallest δRT per LipidMolec', len(window), len(processed_data))
+    else:
+        print(f"Required columns 'ΔRT' and 'LipidMolec' not found. Saving original data.")
+        processed_data = sheet_data
+    # Species-level deduplication runs once, in memory, so each file is written exactly once.
+    return dedup_species(processed_data)
+
+def filter_matches_chunks(chunks, tolerance=5.0, tolerance_unit='%'):
+    # filter_matches over the matched chunks of one file. The δRT window is applied chunk by chunk and only the
+    # smallest-δRT row of each LipidMolec so far is kept between chunks. Returns None if no chunk had a match.
+    chunks = (chunk for chunk in chunks if not chunk.empty)
+    processed_data, start = None, 0
+    for chunk in chunks:
+        if processed_data is None and not ("δRT(%)" in chunk.columns and "LipidMolec" in chunk.columns):
+            return filter_matches(pd.concat([chunk, *chunks]), tolerance, tolerance_unit)
+        # Every matched chunk is numbered from 0; distinct labels keep idxmin exact across chunks.
+        chunk.index = pd.RangeIndex(start, start + len(chunk))
+        start += len(chunk)
+        window = within_window(chunk, tolerance, tolerance_unit)
+        instrument.dropped('δRT window', len(chunk), len(window))
+        processed_data = smallest_delta(window if processed_data is None else pd.concat([processed_data, window]))
+    if processed_data is None:
+        return None
+    # Species-level deduplication runs once, on the rows kept from all chunks.
+    return dedup_species(processed_data.reset_index(drop=True))
+
+def save_processed(processed_data, output_path):
+    with instrument.step('write', len(processed_data)):
+        with pd.ExcelWriter(output_path, engine='openpyxl') as writer:
+            decimal_floats(processed_data).to_excel(writer, sheet_name="ProcessedData", index=False)
+    return processed_data
+
+def filter_and_save(dataframe, output_path, tolerance=5.0, tolerance_unit='%'):
+    try:
+        with instrument.step('filter', len(dataframe)) as counts:
+            processed_data = filter_matches(dataframe, tolerance, tolerance_unit)
+            counts['rows_out'] = len(processed_data)
+        return save_processed(processed_data, output_path)
+    except Exception as e:
+        print(f"Error saving filtered data to file {output_path}: {e}")
+        raise
+
+# Classes deduplicated by dedup_species, in order; a ClassKey belongs to the first one it contains.
+DEDUP_CLASSES = ['TG', 'PC', 'PE', 'DG', 'PA', 'PI', 'PG', 'PS']
+
+def dedup_species(df, return_duplicates=False):
+    # Keep the max-Intensity row of each TG and PC/PE/DG/PA/PI/PG/PS species (same sorted acyl chains).
+    # Rows of these classes whose LipidMolec has no acyl chains are dropped.
+    # return_duplicates=True also returns the side table of species that had more than one row.
+    duplicates = pd.DataFrame()
+    if 'ClassKey' in df.columns and 'LipidMolec' in df.columns and 'Intensity' in df.columns:
+        # Classify each distinct ClassKey once; LipidMolec chains come from the shared name parser.
+        class_keys = df['ClassKey'].dropna().unique()
+        dedup_class = {key: next((name for name in DEDUP_CLASSES if name in key), None)
+                       for key in class_keys if isinstance(key, str)}
+        in_class = df['ClassKey'].map(dedup_class).notna()
+        class_df = df[in_class].copy()
+        class_df['Parsed'] = parse_names(class_df['LipidMolec'])['Chains']
+        # Joining with '\x00' sorts the chain keys exactly like the Parsed tuples.
+        keys = pd.DataFrame({
+            'Class': pd.Categorical(class_df['ClassKey'].map(dedup_class), categories=DEDUP_CLASSES),
+            'Chains': class_df['Parsed'].map(lambda chains: '\x00'.join(chains), na_action='ignore'),
+            'Intensity': class_df['Intensity']})
+        kept, duplicates = keep_max_rows(keys, ['Class', 'Chains'], 'Intensity')
+        instrument.dropped('species dedup', len(class_df), len(kept))
+        duplicates['Chains'] = duplicates['Chains'].str.replace('\x00', '_')
+        if not kept.empty:
+            df = pd.concat([df[~in_class], class_df.loc[kept.index]])
+        else:
+            df = df[~in_class]
+    return (df, duplicates) if return_duplicates else df
+
+def process_file(file_name, source, index_table, output_path, chunk_rows=None, tolerance=5.0, tolerance_unit='%',
+                 grid=None):
+    # chunk_rows: match the input in batches of this many rows instead of all at once (see filter_matches_chunks).
+    if grid is None and not index_table.empty:
+        grid = RTGrid(index_table)
+    if chunk_rows:
+        matched_chunks = (process_excel_step2(chunk, index_table, tolerance, tolerance_unit, grid)
+                          for chunk in iter_table(source, chunk_rows))
+        try:
+            processed_data = filter_matches_chunks(matched_chunks, tolerance, tolerance_unit)
+            if processed_data is None:
+                print(f"{file_name} contains no valid data.")
+                return None
+            os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+            return save_processed(processed_data, output_path)
+        except Exception as e:
+            print(f"Error saving filtered data to file {output_path}: {e}")
+            raise
+    matched_data = process_excel_step2(source, index_table, tolerance, tolerance_unit, grid)
+    if isinstance(matched_data, pd.DataFrame) and not matched_data.empty:
+        os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+        return filter_and_save(matched_data, output_path, tolerance, tolerance_unit)
+    print(f"{file_name} contains no valid data.")
+    return None
+
+def main_process(input_folder, index_file, output_folder, frames=None, workers=None, incremental=True,
+                 chunk_rows=None, tolerance=5.0, tolerance_unit='%'):
+    # frames: optional {name: DataFrame or path} already in memory, used instead of reading input_folder.
+    # workers: number of processes the files are spread over (None: all cores, 1: serial).
+    # index_file: ECN model file, or a folder of models (e.g. Module1-output-2) from which every input gets the
+    # model of its instrument and polarity (see registry.ModelRegistry).
+    # incremental: skip inputs whose result was already made from the same content with the same ECN model.
+    # chunk_rows: match each input in batches of this many rows, to bound the memory used by large files.
+    # tolerance: largest δRT of a match, in % of the RT (tolerance_unit='%') or in minutes (tolerance_unit='min').
+    # Returns {name: filtered DataFrame}, or the result path for a skipped file.
+    if tolerance_unit not in TOLERANCE_UNITS:
+        raise ValueError(f"Unsupported tolerance unit '{tolerance_unit}', expected one of {list(TOLERANCE_UNITS)}")
+    os.makedirs(output_folder, exist_ok=True)
+    if frames is None:
+        frames = table_files(input_folder)
+    manifest = load_manifest(output_folder) if incremental else None
+    keys, cached, models = {}, {}, {}
+    # Each model is parsed once (and kept in memory for the next batch), with the theoretical RTs of its grid.
+    for index_table, grid, model_hash, names in select_models(index_file, frames, read_index_table):
+        sources = {name: frames[name] for name in names}
+        model_keys, model_cached = plan(manifest if grid is not None else None, output_folder, 'lipidsearch', sources,
+                                        model_hash, tolerance, tolerance_unit)
+        keys.update(model_keys)
+        cached.update(model_cached)
+        models.update({name: (index_table, grid) for name in model_keys})
+    results = {name: outputs[0] for name, outputs in cached.items()}
+    output_paths = {file_name: os.path.join(output_folder, f"{file_name}_processed.xlsx") for file_name in keys}
+    tasks = [(file_name, (file_name, frames[file_name], models[file_name][0], output_paths[file_name], chunk_rows,
+                          tolerance, tolerance_unit, models[file_name][1]))
+             for file_name in frames if file_name in keys]
+    for result in run_batch(process_file, tasks, workers):
+        if result.error:
+            print(f"Error processing {result.name}: {result.error}")
+        elif result.value is not None:
+            results[result.name] = result.value
+            record(manifest, output_folder, result.name, keys[result.name], [output_paths[result.name]])
+    if manifest is not None:
+        save_manifest(manifest, output_folder)
+    return {name: results[name] for name in frames if name in results}
@@ -0,0 +1,70 @@
+#Manifest of processed files, so inputs unchanged since the last run of a batch are skipped
+import hashlib
+import json
+import os
+import pandas as pd
+from ecn_tool.storage import file_sha256
+
+# Kept in the output folder of each stage.
+MANIFEST_FILE = os.path.join('.ecn_cache', 'manifest.json')
+# Part of every key; bump it when a change to the modules alters their outputs, so earlier results are redone.
+MANIFEST_VERSION = 1
+
+def frame_sha256(df):
+    digest = hashlib.sha256(json.dumps([str(column) for column in df.columns]).encode('utf-8'))
+    # Cells are hashed as text, which also covers mixed-type and tuple-valued columns.
+    digest.update(pd.util.hash_pandas_object(df.astype(str), index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+def source_sha256(source):
+    # Content hash of an input: the bytes of a file, or for a DataFrame the hash of the file it was saved to
+    # (attrs['sha256'], set by the stage that wrote it) or else of its cells. A list of inputs (e.g. the training
+    # files of a pooled model) is hashed on the hashes of its members.
+    if isinstance(source, list):
+        return hashlib.sha256(json.dumps([source_sha256(member) for member in source]).encode('utf-8')).hexdigest()
+    if isinstance(source, pd.DataFrame):
+        return source.attrs.get('sha256') or frame_sha256(source)
+    return file_sha256(source)
+
+def manifest_key(stage, *parts):
+    # stage: name of the processing step; parts: input hash, model/index hash and parameters of the step.
+    return hashlib.sha256(json.dumps([MANIFEST_VERSION, stage, *parts], default=str).encode('utf-8')).hexdigest()
+
+def load_manifest(output_folder):
+    try:
+        with open(os.path.join(output_folder, MANIFEST_FILE), encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return manifest if isinstance(manifest, dict) else {}
+
+def save_manifest(manifest, output_folder):
+    path = os.path.join(output_folder, MANIFEST_FILE)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+def plan(manifest, output_folder, stage, sources, *parts):
+    # Splits sources {name: path or DataFrame} into the ones to process, {name: key}, and the ones whose
+    # outputs were recorded under the same key and still exist, {name: [output paths]}.
+    # manifest=None (incremental runs off) processes every source.
+    keys, cached = {}, {}
+    for name, source in sources.items():
+        if manifest is None:
+            keys[name] = None
+            continue
+        key = manifest_key(stage, source_sha256(source), *parts)
+        entry = manifest.get(name)
+        outputs = [os.path.join(output_folder, path) for path in entry['outputs']] if entry and entry.get('key') == key else None
+        if outputs is not None and all(os.path.exists(path) for path in outputs):
+            cached[name] = outputs
+        else:
+            keys[name] = key
+    if cached:
+        print(f"Skipped {len(cached)} file(s) unchanged since they were processed into {output_folder}")
+    return keys, cached
+
+def record(manifest, output_folder, name, key, outputs):
+    if manifest is not None:
+        manifest[name] = {'key': key, 'outputs': [os.path.relpath(path, output_folder) for path in outputs]}
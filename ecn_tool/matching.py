@@ -0,0 +1,145 @@
+#Matching of features to ECN models through a grid of theoretical RTs, searched by RT window
+import numpy as np
+import pandas as pd
+from ecn_tool.model import CARBON_RANGE_COLUMNS, COEFFICIENT_COLUMNS, carbon_ranges, theoretical_rt
+
+# Columns a feature shares with the ECN model it is matched to.
+KEY_COLUMNS = ['Ontology', 'Double bond number']
+# Carbon numbers the grid is evaluated at; matching a feature of another carbon number extends it.
+# Alternative carbon numbers (same_carbon=False) are limited to the range each equation was fitted on.
+CARBON_NUMBERS = range(0, 101)
+# A tolerance is given in percent of the observed RT (as δRT(%)) or in minutes.
+TOLERANCE_UNITS = ('%', 'min')
+
+def delta_rt(rt, theor_rt):
+    return ((rt - theor_rt) / rt) * 100
+
+def within_tolerance(rt, theor_rt, tolerance=5.0, unit='%'):
+    # -tolerance < δRT < tolerance; a missing RT is never within it.
+    if unit == '%':
+        delta = delta_rt(rt, theor_rt)
+    elif unit == 'min':
+        delta = rt - theor_rt
+    else:
+        raise ValueError(f"Unsupported tolerance unit '{unit}', expected one of {list(TOLERANCE_UNITS)}")
+    return (delta > -tolerance) & (delta < tolerance)
+
+def model_keys(df):
+    # (Ontology, Double bond number) of a feature or model table, normalized as Module2-2 and Module3 match them.
+    return [df['Ontology'].astype(str).to_numpy(),
+            pd.to_numeric(df['Double bond number'], errors='coerce').fillna(0).astype(int).to_numpy()]
+
+class RTGrid:
+    # Theoretical RT of every equation of an index table (see model.add_coefficients) at every carbon number,
+    # sorted by RT within each (Ontology, Double bond number[, Carbon number]) group. A feature is paired only
+    # with the grid points inside its RT window, found by binary search, so no other pair is ever built.
+    # Points outside the fitted carbon range of their equation (see model.carbon_ranges) are left out of the
+    # alternatives; where the range is unknown, so are the points of a quadratic fit on the branch past its vertex,
+    # where the RT falls as the carbon number grows.
+    def __init__(self, index_table, carbon_numbers=CARBON_NUMBERS):
+        self.index_table = index_table
+        self.carbon_numbers = np.asarray(carbon_numbers, dtype=np.int64)
+        # Rows without an Equation never match, as in the merge they replace.
+        rows = np.flatnonzero(index_table['Equation'].notna().to_numpy())
+        a, b, c = index_table[COEFFICIENT_COLUMNS].to_numpy(dtype=float)[rows].T
+        theor = theoretical_rt(a[:, None], b[:, None], c[:, None], self.carbon_numbers.astype(float)[None, :])
+        finite = np.isfinite(theor).ravel()
+        self.model_row = np.repeat(rows, len(self.carbon_numbers))[finite]
+        self.carbon = np.tile(self.carbon_numbers, len(rows))[finite]
+        self.theor = theor.ravel()[finite]
+        carbon_min, carbon_max = (values[self.model_row] for values in carbon_ranges(index_table))
+        row_position = np.searchsorted(rows, self.model_row)
+        a, b = a[row_position], b[row_position]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rising = np.where(a > 0, self.carbon >= -b / (2 * a), np.where(a < 0, self.carbon <= -b / (2 * a), True))
+        known = ~np.isnan(carbon_min) & ~np.isnan(carbon_max)
+        self.fitted = np.where(known, (self.carbon >= carbon_min) & (self.carbon <= carbon_max), rising)
+        ontology, double_bond = model_keys(index_table)
+        self._keys = [ontology[self.model_row], double_bond[self.model_row]]
+        self._layouts = {}
+
+    def _layout(self, same_carbon):
+        # Grid points sorted by group and RT, the groups, and each point's position as one increasing number.
+        if same_carbon not in self._layouts:
+            points = np.arange(len(self.theor)) if same_carbon else np.flatnonzero(self.fitted)
+            keys = self._keys + [self.carbon] if same_carbon else self._keys
+            codes, groups = pd.factorize(pd.MultiIndex.from_arrays([key[points] for key in keys]))
+            sort = np.lexsort((self.theor[points], codes))
+            order = points[sort]
+            low, high = (self.theor.min(), self.theor.max()) if len(self.theor) else (0.0, 0.0)
+            # Groups are laid out one after the other, each spanning more than the whole RT range.
+            span = high - low + 3
+            position = codes[sort] * span + (self.theor[order] - low)
+            self._layouts[same_carbon] = (order, groups, position, low, high, span)
+        return self._layouts[same_carbon]
+
+    def match(self, features, rt_column, tolerance=5.0, unit='%', top_k=None, same_carbon=True,
+              carbon_column='Carbon number'):
+        # Pairs of features and grid points within tolerance, as a DataFrame of the feature's position in
+        # features ('Feature'), the model's position in the index table ('Model'), the 'Carbon number' and
+        # 'TheorRT(min)' of the grid point, in feature order and then index table order.
+        # same_carbon=True matches a feature at the carbon number of its name only, as Module2-2 and Module3 do;
+        # same_carbon=False matches it at every carbon number of its (Ontology, Double bond number) models within
+        # the fitted carbon range of each.
+        # top_k: keep the top_k closest points of each feature, ranked in 'Rank' from 1, closest first.
+        if unit not in TOLERANCE_UNITS:
+            raise ValueError(f"Unsupported tolerance unit '{unit}', expected one of {list(TOLERANCE_UNITS)}")
+        keys = model_keys(features)
+        if same_carbon:
+            carbon = pd.to_numeric(features[carbon_column], errors='coerce').fillna(0).astype(int).to_numpy()
+            if len(carbon) and (carbon.min() < self.carbon_numbers.min() or carbon.max() > self.carbon_numbers.max()):
+                grid = RTGrid(self.index_table, range(min(carbon.min(), self.carbon_numbers.min()),
+                                                      max(carbon.max(), self.carbon_numbers.max()) + 1))
+                return grid.match(features, rt_column, tolerance, unit, top_k, same_carbon, carbon_column)
+            keys.append(carbon)
+        order, groups, position, low, high, span = self._layout(same_carbon)
+        group = groups.get_indexer(pd.MultiIndex.from_arrays(keys)) if len(features) else np.empty(0, dtype=int)
+        rt = features[rt_column].to_numpy(dtype=float)
+        if unit == '%':
+            bounds = np.stack([rt * (1 - tolerance / 100), rt * (1 + tolerance / 100)])
+            window_low, window_high = bounds.min(axis=0), bounds.max(axis=0)
+        else:
+            window_low, window_high = rt - tolerance, rt + tolerance
+        # The window is searched slightly wider and the pairs found are then checked exactly.
+        margin = 1e-6 * (1 + np.abs(rt))
+        window_low = np.clip(window_low - margin, low - 1, high + 1) - low
+        window_high = np.clip(window_high + margin, low - 1, high + 1) - low
+        start = np.searchsorted(position, group * span + window_low, side='left')
+        end = np.searchsorted(position, group * span + window_high, side='right')
+        valid = (group >= 0) & np.isfinite(window_low) & np.isfinite(window_high)
+        counts = np.where(valid, end - start, 0).clip(min=0)
+        feature = np.repeat(np.arange(len(features)), counts)
+        offset = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        point = order[np.repeat(start, counts) + offset]
+        keep = within_tolerance(rt[feature], self.theor[point], tolerance, unit)
+        feature, point = feature[keep], point[keep]
+        if top_k is None:
+            sort = np.lexsort((self.carbon[point], self.model_row[point], feature))
+        else:
+            delta = delta_rt(rt[feature], self.theor[point]) if unit == '%' else rt[feature] - self.theor[point]
+            sort = np.lexsort((self.carbon[point], self.model_row[point], np.abs(delta), feature))
+        feature, point = feature[sort], point[sort]
+        pairs = pd.DataFrame({'Feature': feature, 'Model': self.model_row[point], 'Carbon number': self.carbon[point],
+                              'TheorRT(min)': self.theor[point]})
+        if top_k is not None:
+            first = np.searchsorted(feature, feature, side='left')
+            pairs['Rank'] = np.arange(len(feature)) - first + 1
+            pairs = pairs[pairs['Rank'] <= top_k].reset_index(drop=True)
+        return pairs
+
+def match_table(features, grid, rt_column, tolerance=5.0, unit='%', top_k=None, same_carbon=True,
+                suffixes=('', '_matched')):
+    # The features joined to the model rows they match within tolerance, with their TheorRT(min): the rows of
+    # a merge on (Ontology, Double bond number) that fall within the window. Model columns that clash with
+    # feature columns get the suffixes, as in a merge. With same_carbon=False the carbon number of each grid
+    # point is added as 'ECN carbon number', and with top_k its rank as 'Rank'.
+    pairs = grid.match(features, rt_column, tolerance, unit, top_k, same_carbon)
+    models = grid.index_table.drop(columns=KEY_COLUMNS + COEFFICIENT_COLUMNS + CARBON_RANGE_COLUMNS, errors='ignore')
+    matched = features.iloc[pairs['Feature'].to_numpy()].reset_index(drop=True).join(
+        models.iloc[pairs['Model'].to_numpy()].reset_index(drop=True), lsuffix=suffixes[0], rsuffix=suffixes[1])
+    if not same_carbon:
+        matched['ECN carbon number'] = pairs['Carbon number'].to_numpy()
+    matched['TheorRT(min)'] = pairs['TheorRT(min)'].to_numpy()
+    if top_k is not None:
+        matched['Rank'] = pairs['Rank'].to_numpy()
+    return matched
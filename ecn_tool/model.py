@@ -0,0 +1,138 @@
+#ECN model equations as numeric coefficients, and the JSON model file written by Module1-2
+import json
+import re
+import numpy as np
+import pandas as pd
+
+MODEL_FORMAT = 'ecn-model'
+MODEL_VERSION = 1
+# Columns of the Excel model written by Module1-2.
+MODEL_COLUMNS = ['Ontology', 'Double bond number', 'Fit Type', 'Equation', 'R^2']
+# Internal coefficient columns of y = a*x^2 + b*x + c (a = 0 for linear fits).
+COEFFICIENT_COLUMNS = ['ECN a', 'ECN b', 'ECN c']
+# Internal columns of the carbon range an equation was fitted on (carbon_min/carbon_max of a JSON model).
+CARBON_RANGE_COLUMNS = ['ECN carbon min', 'ECN carbon max']
+# Carbon numbers of the accepted fit of an Excel model (a list, or its text once saved).
+FITTED_CARBON_COLUMN = 'X_R_data'
+_NUMBER = re.compile(r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?')
+_TERM = re.compile(r'([+-]?)((?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)?(?:\*?(x)(?:(?:\^|\*\*)(\d+))?)?')
+
+def parse_equation(equation):
+    # 'y = 0.0511x^2 + -3.9965x + 82.6903' -> (0.0511, -3.9965, 82.6903)
+    if not isinstance(equation, str):
+        raise ValueError(f"Equation {equation!r} is not a string")
+    expression = equation.replace(' ', '').split('=')[-1].replace('+-', '-')
+    if not expression:
+        raise ValueError(f"Equation {equation!r} has no terms")
+    coefficients = [0.0, 0.0, 0.0]
+    pos = 0
+    while pos < len(expression):
+        match = _TERM.match(expression, pos)
+        sign, value, x, power = match.groups()
+        if match.end() == pos or (value is None and x is None) or (pos > 0 and not sign):
+            raise ValueError(f"Cannot parse Equation {equation!r} at '{expression[pos:]}'")
+        degree = 0 if x is None else int(power or 1)
+        if degree > 2:
+            raise ValueError(f"Equation {equation!r} is of degree {degree}, expected at most 2")
+        value = float(value) if value else 1.0
+        coefficients[2 - degree] += -value if sign == '-' else value
+        pos = match.end()
+    return tuple(coefficients)
+
+def add_coefficients(index_table, equation_column='Equation'):
+    # Parse every distinct Equation once and store its coefficients in COEFFICIENT_COLUMNS.
+    parsed = {}
+    for equation in index_table[equation_column].dropna().unique():
+        try:
+            parsed[equation] = parse_equation(equation)
+        except ValueError as e:
+            print(f"Error parsing Equation {equation}: {e}")
+            parsed[equation] = (np.nan, np.nan, np.nan)
+    coefficients = [parsed.get(equation, (np.nan, np.nan, np.nan)) for equation in index_table[equation_column]]
+    index_table = index_table.copy()
+    index_table[COEFFICIENT_COLUMNS] = pd.DataFrame(coefficients, index=index_table.index, columns=COEFFICIENT_COLUMNS,
+                                                    dtype=float)
+    return index_table
+
+def _fitted_range(carbon_numbers):
+    # (min, max) of the carbon numbers of a fit, NaN if there are none.
+    if isinstance(carbon_numbers, str):
+        carbon_numbers = [float(value) for value in _NUMBER.findall(carbon_numbers)]
+    elif not isinstance(carbon_numbers, (list, tuple, np.ndarray)):
+        return np.nan, np.nan
+    carbon_numbers = np.asarray(carbon_numbers, dtype=float)
+    if carbon_numbers.size == 0:
+        return np.nan, np.nan
+    return carbon_numbers.min(), carbon_numbers.max()
+
+def carbon_ranges(index_table):
+    # (min, max) arrays of the carbon range each equation of an index table was fitted on: the CARBON_RANGE_COLUMNS
+    # of a JSON model, or those of the X_R_data of an Excel model; NaN where the table does not tell.
+    if all(column in index_table.columns for column in CARBON_RANGE_COLUMNS):
+        return tuple(index_table[column].to_numpy(dtype=float) for column in CARBON_RANGE_COLUMNS)
+    if FITTED_CARBON_COLUMN in index_table.columns:
+        ranges = np.array([_fitted_range(value) for value in index_table[FITTED_CARBON_COLUMN]], dtype=float)
+        return ranges.reshape(-1, 2)[:, 0], ranges.reshape(-1, 2)[:, 1]
+    return np.full(len(index_table), np.nan), np.full(len(index_table), np.nan)
+
+def theoretical_rt(a, b, c, carbon_number):
+    return a * carbon_number ** 2 + b * carbon_number + c
+
+def evaluate(df, carbon_column='Carbon number'):
+    # Theoretical RT of every row of a frame merged with a coefficient table.
+    return theoretical_rt(df[COEFFICIENT_COLUMNS[0]].to_numpy(), df[COEFFICIENT_COLUMNS[1]].to_numpy(),
+                          df[COEFFICIENT_COLUMNS[2]].to_numpy(), df[carbon_column].to_numpy(dtype=float))
+
+def format_equation(fit_type, coefficients):
+    a, b, c = coefficients
+    if fit_type == 'Linear':
+        return f"y = {b:.4f}x + {c:.4f}"
+    return f"y = {a:.4f}x^2 + {b:.4f}x + {c:.4f}"
+
+def model_record(ontology, double_bond, fit_type, coefficients, r2, x, y):
+    # One fitted (Ontology, Double bond number) group; x/y are the points the accepted fit was made on.
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    residuals = y - theoretical_rt(*coefficients, x)
+    try:
+        double_bond = int(double_bond)
+    except (TypeError, ValueError):
+        pass
+    return {
+        'Ontology': ontology,
+        'Double bond number': double_bond,
+        'Fit Type': fit_type,
+        'coefficients': [float(value) for value in coefficients],
+        'r2': float(r2),
+        'carbon_min': float(x.min()),
+        'carbon_max': float(x.max()),
+        'n_points': int(len(x)),
+        'residual_std': float(np.std(residuals)),
+    }
+
+def save_model(path, records, source_name=None, source_hash=None):
+    model = {
+        'format': MODEL_FORMAT,
+        'version': MODEL_VERSION,
+        'source': {'file': source_name, 'sha256': source_hash},
+        'models': records,
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(model, f)
+    return path
+
+def load_model(path):
+    # Coefficient table of a JSON model, with the same columns as an Excel model parsed by add_coefficients.
+    with open(path, encoding='utf-8') as f:
+        model = json.load(f)
+    if model.get('format') != MODEL_FORMAT:
+        raise ValueError(f"{path} is not an ECN model file")
+    if model.get('version', 0) > MODEL_VERSION:
+        raise ValueError(f"{path} has model version {model['version']}, this tool reads up to {MODEL_VERSION}")
+    rows = []
+    for record in model['models']:
+        coefficients = record['coefficients']
+        rows.append([record['Ontology'], record['Double bond number'], record['Fit Type'],
+                     format_equation(record['Fit Type'], coefficients), round(record['r2'], 3), *coefficients,
+                     record.get('carbon_min', np.nan), record.get('carbon_max', np.nan)])
+    return pd.DataFrame(rows, columns=MODEL_COLUMNS + COEFFICIENT_COLUMNS + CARBON_RANGE_COLUMNS)
@@ -0,0 +1,121 @@
+#Module 1 -> 2 -> 3 in one process, passing the tables between modules in memory
+import os
+from ecn_tool import INDEX_OF_CLASS, class_match, consolidate, construction, lipidsearch, msdial, preprocess
+from ecn_tool.registry import POOLED_FOLDER
+from ecn_tool.storage import table_columns, table_files, table_stem
+
+# Output folders of a run, named like the folders the module scripts write to.
+OUTPUT_FOLDERS = {
+    'preprocess': 'Module1-output-1',
+    'model': 'Module1-output-2',
+    'class_match': 'Module2-output-1',
+    'lipidsearch': 'Module2-output-2',
+    'msdial': 'Module3-output',
+    'consolidated': 'Consolidated-output',
+}
+# Formats of the consolidated results (see consolidate.save_consolidated).
+CONSOLIDATED_FORMATS = ('xlsx', 'parquet')
+
+def input_kind(columns):
+    # 'lipidsearch' for LipidSearch results, 'msdial' for MS-DIAL results, None for anything else.
+    if 'ClassKey' in columns and 'LipidGroupKey' in columns:
+        return 'lipidsearch'
+    if 'Name' in columns and 'RT (min)' in columns:
+        return 'msdial'
+    return None
+
+def collect_inputs(inputs):
+    # {'lipidsearch': {name: path}, 'msdial': {name: path}} of the table files given directly or found in the
+    # given folders and their subfolders, by input_kind. Files found in a folder are named by their path within
+    # it, so the outputs keep its subfolder layout. Names are unique within each kind only: the LipidSearch and
+    # MS-DIAL results of a sample are often named alike (e.g. Astral/Astral_NEG_Cell-25).
+    paths = {'lipidsearch': {}, 'msdial': {}}
+    for item in inputs:
+        if os.path.isdir(item):
+            found = list(table_files(item).items())
+        else:
+            found = [(table_stem(item), item)]
+        for name, path in found:
+            kind = input_kind(table_columns(path))
+            if kind is None:
+                print(f"Skipped {path}: neither a LipidSearch nor an MS-DIAL result table.")
+            elif name in paths[kind]:
+                print(f"Skipped {path}: an input named {name} was already given ({paths[kind][name]})")
+            else:
+                paths[kind][name] = path
+    return paths
+
+def build_model(model, output_folder, output_format='xlsx', intermediate=True, incremental=True, chunk_rows=None,
+                workers=1, pool=False):
+    # The ECN model used by Module2-2 and Module3: a model file written by Module1-2 (.json or .xlsx) is used
+    # as it is, as is a folder of model files (each input then gets the model of its instrument and polarity),
+    # MS-DIAL training data is run through Module1-1 and Module1-2 first.
+    # workers: number of processes the groups of the model are fitted in.
+    # pool: fit one model per instrument and polarity on all the training data in model (a file or folder),
+    # returning the folder of these models alone, so no other model in Module1-output-2 can be picked instead.
+    if pool:
+        model_folder = os.path.join(output_folder, OUTPUT_FOLDERS['model'])
+        training = collect_inputs([model])['msdial']
+        models = construction.process_pooled_folder(None, model_folder, frames=training, workers=workers,
+                                                    incremental=incremental, chunk_rows=chunk_rows)
+        return os.path.join(model_folder, POOLED_FOLDER) if models else None
+    if os.path.isdir(model) or model.endswith('.json') or 'Equation' in table_columns(model):
+        return model
+    name = table_stem(model)
+    preprocess_folder = os.path.join(output_folder, OUTPUT_FOLDERS['preprocess']) if intermediate else None
+    frames = preprocess.main_process(None, preprocess_folder, output_format, frames={name: model}, workers=1,
+                                     incremental=incremental, chunk_rows=chunk_rows)
+    models = construction.process_folder(None, os.path.join(output_folder, OUTPUT_FOLDERS['model']),
+                                         frames=frames, workers=workers, incremental=incremental)
+    return models.get(name)
+
+def run_pipeline(model, inputs, output_folder='.', index_file=INDEX_OF_CLASS, output_format='xlsx',
+                 workers=1, intermediate=True, incremental=True, chunk_rows=None, tolerance=5.0, tolerance_unit='%',
+                 consolidated_format=None, pool=False):
+    # model: ECN model file or folder of model files, or MS-DIAL training data to build it from (see build_model);
+    # pool=True pools all the training data into one model per instrument and polarity.
+    # inputs: LipidSearch and MS-DIAL result tables, or folders of them; each table goes to Module2 or Module3
+    # by its columns.
+    # index_file: index of class used to convert the classes of the LipidSearch inputs (Module2-1).
+    # intermediate=False skips writing the Module1-output-1 and Module2-output-1 tables.
+    # incremental=False processes every input again, even if it is unchanged since the last run.
+    # chunk_rows: read the inputs in batches of this many rows, to bound the memory used by large files.
+    # tolerance: largest δRT of an ECN match, in % of the RT (tolerance_unit='%') or in minutes ('min').
+    # consolidated_format: also save the results of all inputs as one long table, species matrix and overlap
+    # statistics (see ecn_tool.consolidate), as 'xlsx' or 'parquet'; None skips it.
+    # Returns {'model': ..., 'lipidsearch': {name: result}, 'msdial': {name: result}}, where a result is the
+    # filtered DataFrame, or the path of the result file of an input skipped as unchanged, and 'consolidated'
+    # with the long table if consolidated_format is set.
+    if consolidated_format is not None and consolidated_format not in CONSOLIDATED_FORMATS:
+        raise ValueError(f"Unsupported consolidated format '{consolidated_format}', "
+                         f"expected one of {list(CONSOLIDATED_FORMATS)}")
+    frames = collect_inputs(inputs)
+    if frames['lipidsearch'] and not os.path.exists(index_file):
+        print(f"Index of class {index_file} does not exist; it is needed for the LipidSearch inputs.")
+        return {}
+    index_table = build_model(model, output_folder, output_format, intermediate, incremental, chunk_rows, workers,
+                              pool)
+    if index_table is None:
+        print(f"No ECN model could be built from {model}.")
+        return {}
+    results = {'model': index_table, 'lipidsearch': {}, 'msdial': {}}
+    if frames['lipidsearch']:
+        class_match_folder = os.path.join(output_folder, OUTPUT_FOLDERS['class_match']) if intermediate else None
+        classified = class_match.process_files(None, index_file, class_match_folder, output_format,
+                                               frames=frames['lipidsearch'], workers=workers, incremental=incremental,
+                                               chunk_rows=chunk_rows)
+        results['lipidsearch'] = lipidsearch.main_process(None, index_table,
+                                                          os.path.join(output_folder, OUTPUT_FOLDERS['lipidsearch']),
+                                                          frames=classified, workers=workers, incremental=incremental,
+                                                          chunk_rows=chunk_rows, tolerance=tolerance,
+                                                          tolerance_unit=tolerance_unit)
+    if frames['msdial']:
+        results['msdial'] = msdial.main_process(None, index_table, os.path.join(output_folder, OUTPUT_FOLDERS['msdial']),
+                                                frames=frames['msdial'], workers=workers, incremental=incremental,
+                                                chunk_rows=chunk_rows, tolerance=tolerance, tolerance_unit=tolerance_unit)
+    if consolidated_format is not None:
+        long = consolidate.consolidate(results['lipidsearch'], results['msdial'], workers)
+        consolidate.save_consolidated(long, os.path.join(output_folder, OUTPUT_FOLDERS['consolidated'],
+                                                         'consolidated.' + consolidated_format))
+        results['consolidated'] = long
+    return results
@@ -0,0 +1,109 @@
+#Preprocess of MS-DIAL lipid data (Module1-1)
+import itertools
+import os
+import pandas as pd
+from ecn_tool import instrument
+from ecn_tool.batch import run_batch
+from ecn_tool.dedup import keep_max_rows, keep_max_rows_chunks
+from ecn_tool.lipid_names import parse_names
+from ecn_tool.manifest import load_manifest, plan, record, save_manifest
+from ecn_tool.storage import (export_columns, file_sha256, iter_table, read_table, table_files, table_path,
+                              write_table)
+
+# Columns read from a native MS-DIAL text export (see ecn_tool.storage.EXPORT_DTYPES).
+INPUT_COLUMNS = ['Name', 'Ontology', 'RT (min)', 'Height']
+
+def process_lipid_group_key(df):
+    # A Name without a 'C:DB' pair (e.g. 'CoQ10', 'Inosine') is kept as its own Carbon number and Double bond number.
+    if 'Name' in df.columns:
+        parsed = parse_names(df['Name'])
+        unparsed = parsed['Carbon number'].isna() | parsed['Double bond number'].isna()
+        carbon = parsed['Carbon number'].astype(object).mask(unparsed, df['Name'])
+        double_bond = parsed['Double bond number'].astype(object).mask(unparsed, df['Name'])
+        df.insert(df.columns.get_loc('Name') + 1, 'Carbon number', carbon)
+        df.insert(df.columns.get_loc('Carbon number') + 1, 'Double bond number', double_bond)
+    return df
+
+def filter_by_max_height(df, return_duplicates=False):
+    # Keeps the max-Height row(s) of each (Ontology, Carbon number, Double bond number) group.
+    # return_duplicates=True also returns the side table of groups that had more than one row.
+    required_columns = ['Ontology', 'Carbon number', 'Double bond number', 'Height']
+    if not all(col in df.columns for col in required_columns):
+        print(f"File is missing required columns, skip processing.")
+        return (pd.DataFrame(), pd.DataFrame()) if return_duplicates else pd.DataFrame()
+    processed_df, duplicates = keep_max_rows(df, required_columns[:3], 'Height', keep_ties=True)
+    processed_df = processed_df.reset_index(drop=True)
+    return (processed_df, duplicates) if return_duplicates else processed_df
+
+def filter_by_max_height_chunks(chunks, return_duplicates=False):
+    # filter_by_max_height over the chunks of one file, keeping only the max-Height rows found so far between chunks.
+    required_columns = ['Ontology', 'Carbon number', 'Double bond number', 'Height']
+    chunks = iter(chunks)
+    first = next(chunks, None)
+    if first is None or not all(col in first.columns for col in required_columns):
+        print("File is missing required columns, skip processing.")
+        return (pd.DataFrame(), pd.DataFrame()) if return_duplicates else pd.DataFrame()
+    processed_df, duplicates = keep_max_rows_chunks(itertools.chain([first], chunks), required_columns[:3], 'Height',
+                                                    keep_ties=True)
+    processed_df = processed_df.reset_index(drop=True)
+    return (processed_df, duplicates) if return_duplicates else processed_df
+
+def process_file(name, source, output_folder, output_format='xlsx', chunk_rows=None):
+    # chunk_rows: read and parse the input in batches of this many rows instead of all at once.
+    columns = export_columns(source, INPUT_COLUMNS)
+    if chunk_rows:
+        # Reading, parsing and deduplication run chunk by chunk, so they are timed as one step.
+        with instrument.step('read+parse+dedup') as counts:
+            chunks = instrument.counted(iter_table(source, chunk_rows, columns), counts)
+            processed_df, duplicates = filter_by_max_height_chunks((process_lipid_group_key(chunk) for chunk in chunks),
+                                                                   return_duplicates=True)
+            counts['rows_out'] = len(processed_df)
+        rows_in = counts['rows_in']
+    else:
+        with instrument.step('read') as counts:
+            df = read_table(source, columns)
+            counts['rows_out'] = rows_in = len(df)
+        with instrument.step('parse', rows_in):
+            df_with_lipid_info = process_lipid_group_key(df)
+        with instrument.step('dedup', rows_in) as counts:
+            processed_df, duplicates = filter_by_max_height(df_with_lipid_info, return_duplicates=True)
+            counts['rows_out'] = len(processed_df)
+    if not processed_df.empty:
+        instrument.dropped('max Height per species', rows_in, len(processed_df))
+        if output_folder:
+            with instrument.step('write', len(processed_df)):
+                output_file = write_table(processed_df, table_path(output_folder, name, output_format))
+            # Lets the next stage key its manifest on the file it would otherwise read.
+            processed_df.attrs['sha256'] = file_sha256(output_file)
+            print(f"Processed file {name} ({len(duplicates)} duplicated species reduced to max Height) "
+                  f"and saved to {output_file}")
+    else:
+        print(f"{name} could not be processed successfully, necessary column may be missing.")
+    return processed_df
+
+def main_process(input_folder, output_folder, output_format='xlsx', frames=None, workers=None, incremental=True,
+                 chunk_rows=None):
+    # frames: optional {name: DataFrame or path} already in memory, used instead of reading input_folder.
+    # workers: number of processes the files are spread over (None: all cores, 1: serial).
+    # incremental: skip inputs whose output was already made from the same content and settings (see ecn_tool.manifest).
+    # chunk_rows: read each input in batches of this many rows, to bound the memory used by large files.
+    # Returns {name: processed DataFrame}, or the output path for a skipped file.
+    if output_folder:
+        os.makedirs(output_folder, exist_ok=True)
+    if frames is None:
+        frames = table_files(input_folder)
+    manifest = load_manifest(output_folder) if incremental and output_folder else None
+    keys, cached = plan(manifest, output_folder, 'preprocess', frames, output_format)
+    results = {name: outputs[0] for name, outputs in cached.items()}
+    tasks = [(name, (name, frames[name], output_folder, output_format, chunk_rows)) for name in keys]
+    for result in run_batch(process_file, tasks, workers):
+        if result.error:
+            print(f"Error processing {result.name}: {result.error}")
+        elif not result.value.empty:
+            results[result.name] = result.value
+            if manifest is not None:
+                record(manifest, output_folder, result.name, keys[result.name],
+                       [table_path(output_folder, result.name, output_format)])
+    if manifest is not None:
+        save_manifest(manifest, output_folder)
+    return {name: results[name] for name in frames if name in results}
@@ -0,0 +1,119 @@
+#Registry of the ECN models of a Module1-output-2 folder, picked per input file by instrument and polarity
+import os
+import re
+from collections import OrderedDict
+from ecn_tool.manifest import frame_sha256
+from ecn_tool.matching import RTGrid
+from ecn_tool.storage import list_tables, table_name
+
+# Instruments and polarities, as written in the file names of the models and of the inputs.
+INSTRUMENTS = {'QE': ('qe',), 'Astral': ('astral',)}
+POLARITIES = {'POS': ('pos', 'positive'), 'NEG': ('neg', 'negative')}
+# The JSON model is used when both files of a model exist: it holds the coefficients at full precision.
+MODEL_EXTENSIONS = ('_processed.json', '_processed.xlsx')
+# Subfolder of a model folder that the pooled models of Module1-2 are written to (see
+# construction.process_pooled_folder), apart from the models of single training files.
+POOLED_FOLDER = 'pooled'
+# Number of parsed models kept in memory by load_model_table.
+CACHE_SIZE = 8
+# (path, modification time, size) -> (index table, RT grid, model hash), least recently used first.
+_cache = OrderedDict()
+
+def instrument_polarity(name):
+    # ('QE' or 'Astral' or None, 'POS' or 'NEG' or None) from a file name or relative path,
+    # e.g. 'QE/QE-POS-20MIN-Cell-1' -> ('QE', 'POS'), 'Astral_NEG_Mixture-25_processed' -> ('Astral', 'NEG').
+    tokens = [token.lower() for token in re.split(r'[^0-9A-Za-z]+', str(name)) if token]
+    found = []
+    for labels in (INSTRUMENTS, POLARITIES):
+        found.append(next((label for token in tokens for label, aliases in labels.items() if token in aliases), None))
+    return tuple(found)
+
+def is_pooled(name):
+    # True for a pooled model (e.g. 'pooled/QE-POS-pooled_processed'), fitted on all training files of its
+    # instrument and polarity.
+    return os.path.basename(str(name)).endswith('pooled_processed')
+
+def load_model_table(source, reader):
+    # (index table, RTGrid, model hash) of a model file read with reader (read_index_table of Module2-2 or
+    # Module3, which give the same table), or of a model DataFrame. A file is parsed once and kept in an LRU
+    # cache of CACHE_SIZE models until it is modified; the grid is None for an empty table.
+    if not isinstance(source, str):
+        return _parsed(reader(source))
+    stat = os.stat(source)
+    key = (os.path.abspath(source), stat.st_mtime_ns, stat.st_size)
+    if key in _cache:
+        _cache.move_to_end(key)
+        return _cache[key]
+    parsed = _parsed(reader(source))
+    _cache[key] = parsed
+    while len(_cache) > CACHE_SIZE:
+        _cache.popitem(last=False)
+    return parsed
+
+def _parsed(index_table):
+    if index_table.empty:
+        return index_table, None, None
+    # The model is keyed on its parsed coefficients, so saving it again unchanged keeps earlier results current.
+    return index_table, RTGrid(index_table), frame_sha256(index_table)
+
+def clear_cache():
+    _cache.clear()
+
+class ModelRegistry:
+    # The ECN models (_processed.json or .xlsx files of Module1-2) in a folder and its subfolders, by instrument
+    # and polarity.
+    def __init__(self, folder='Module1-output-2'):
+        self.folder = folder
+        self.models = {}
+        for extension in MODEL_EXTENSIONS:
+            for file_name in list_tables(folder, (extension,)):
+                self.models.setdefault(table_name(file_name), os.path.join(folder, file_name))
+        self.keys = {name: instrument_polarity(name) for name in self.models}
+        self.warned = set()
+
+    def select(self, input_name):
+        # Path of the model of the input's instrument and polarity; None if the name lacks either, or no model
+        # has them. Among several such models, the one in the same subfolder as the input (e.g. QE/ for
+        # 'QE/QE-POS-20MIN-Cell-1') is used, then a model of a single training file over a pooled one, then the
+        # most recently modified one. Pooled models are preferred only by a run that asks for them, which passes
+        # their own folder (see pipeline.build_model), so building one never changes the model of later runs.
+        key = instrument_polarity(input_name)
+        if None in key:
+            return None
+        candidates = [name for name, model_key in self.keys.items() if model_key == key]
+        if len(candidates) > 1 and key not in self.warned:
+            self.warned.add(key)
+            print(f"Several ECN models for {' '.join(key)} in {self.folder} ({', '.join(sorted(candidates))}): "
+                  f"each input uses the one in its own subfolder, else the newest not pooled one.")
+        if not candidates:
+            return None
+        subfolder = os.path.dirname(str(input_name))
+        return self.models[max(candidates, key=lambda name: (os.path.dirname(name) == subfolder, not is_pooled(name),
+                                                             os.path.getmtime(self.models[name]), name))]
+
+    def load(self, path, reader):
+        return load_model_table(path, reader)
+
+def is_registry(index_file):
+    return isinstance(index_file, str) and os.path.isdir(index_file)
+
+def select_models(index_file, frames, reader):
+    # [(index table, RTGrid, model hash, input names)]: the model each input of frames is matched with.
+    # index_file: a model file or DataFrame used for every input, or a folder of models (see ModelRegistry)
+    # from which each input gets the model of its instrument and polarity; inputs without one are skipped.
+    if not is_registry(index_file):
+        return [(*load_model_table(index_file, reader), list(frames))]
+    registry = ModelRegistry(index_file)
+    assigned = {}
+    for name in frames:
+        path = registry.select(name)
+        if path is None:
+            instrument, polarity = instrument_polarity(name)
+            print(f"Skipped {name}: no ECN model in {index_file} for instrument {instrument} and polarity {polarity}.")
+        else:
+            assigned.setdefault(path, []).append(name)
+    selected = []
+    for path, names in assigned.items():
+        print(f"ECN model {os.path.basename(path)}: {len(names)} file(s)")
+        selected.append((*registry.load(path, reader), names))
+    return selected
@@ -0,0 +1,373 @@
+#Storage layer for the intermediate tables passed between modules
+import hashlib
+import os
+import pandas as pd
+
+# File extension used for each supported storage format.
+FORMATS = {
+    'xlsx': '.xlsx',
+    'parquet': '.parquet',
+    'arrow': '.arrow',
+}
+READABLE_EXTENSIONS = ('.xlsx', '.xls', '.parquet', '.arrow', '.feather', '.csv', '.tsv', '.txt')
+# Delimiter of the text formats, which are read but not written.
+TEXT_SEPARATORS = {'.csv': ',', '.tsv': '\t', '.txt': '\t'}
+# Native tab-delimited exports of MS-DIAL and LipidSearch.
+EXPORT_EXTENSIONS = ('.txt',)
+# dtypes of the export columns the modules use: repeated labels as categories, the MS-DIAL RT (3 decimals) as
+# float32. Intensities and the LipidSearch TopRT (15 digits) are left to pandas, int64 or float64 as in Excel:
+# float32 would round them to ~7 digits (Height 113900411 -> 113900410).
+EXPORT_DTYPES = {
+    'Name': 'str',
+    'Ontology': 'category',
+    'RT (min)': 'float32',
+    'ClassKey': 'category',
+    'SubClassKey': 'str',
+    'Adduct': 'category',
+    'LipidGroupKey': 'str',
+    'LipidMolec': 'str',
+}
+
+def table_stem(file_name):
+    return os.path.splitext(os.path.basename(file_name))[0]
+
+def table_path(folder, stem, fmt='xlsx'):
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported storage format '{fmt}', expected one of {sorted(FORMATS)}")
+    return os.path.join(folder, stem + FORMATS[fmt])
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError("Parquet/Arrow storage requires the 'pyarrow' package (pip install pyarrow).")
+    return pyarrow
+
+def _typed_columns(df):
+    # Excel cells are loosely typed; Arrow columns are not. Object columns holding
+    # more than one Python type (e.g. str and int) are stored as text.
+    df = df.copy()
+    for col in df.columns:
+        if df[col].dtype == object:
+            types = {type(value) for value in df[col].dropna()}
+            if len(types) > 1:
+                df[col] = df[col].map(lambda value: value if pd.isna(value) else str(value))
+    df.columns = [str(col) for col in df.columns]
+    return df
+
+def export_columns(source, columns):
+    # The columns to read of a stage input: only those the stage uses (columns) for a native text export,
+    # every column (None) for any other table.
+    if isinstance(source, str) and source.endswith(EXPORT_EXTENSIONS):
+        return columns
+    return None
+
+def _read_export(path, columns=None, chunk_rows=None):
+    # Columns missing from the export are left out rather than failing the read, so the stages report them.
+    usecols = None if columns is None else (lambda column: column in columns)
+    # round_trip parses every decimal to the float64 read_excel gives for it.
+    return pd.read_csv(path, sep='\t', usecols=usecols, dtype=EXPORT_DTYPES, chunksize=chunk_rows,
+                       float_precision='round_trip')
+
+def read_table(path, columns=None):
+    if isinstance(path, pd.DataFrame):
+        df = path[columns].copy() if columns is not None else path.copy()
+        # attrs['sha256'] (see ecn_tool.manifest) describes the saved table, not copies that are then modified.
+        df.attrs = {}
+        return df
+    if path.endswith('.parquet'):
+        _require_pyarrow()
+        return pd.read_parquet(path, columns=columns)
+    if path.endswith(('.arrow', '.feather')):
+        _require_pyarrow()
+        return pd.read_feather(path, columns=columns)
+    if path.endswith(EXPORT_EXTENSIONS):
+        return _read_export(path, columns)
+    if path.endswith(tuple(TEXT_SEPARATORS)):
+        return pd.read_csv(path, sep=TEXT_SEPARATORS[os.path.splitext(path)[1]], usecols=columns)
+    return pd.read_excel(path, usecols=columns)
+
+def _excel_value(value):
+    # As read_excel does: whole-number floats become ints.
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+def _excel_frame(rows, columns):
+    df = pd.DataFrame(rows, columns=columns)
+    # Empty columns are read as NaN, as in read_excel.
+    for column in df.columns[(df.dtypes == object).to_numpy() & df.isna().all().to_numpy()]:
+        df[column] = df[column].astype(float)
+    return df
+
+def _excel_chunks(path, chunk_rows):
+    from openpyxl import load_workbook
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        header = list(header)
+        # Trailing empty header cells are not columns, as in read_excel.
+        while header and header[-1] is None:
+            header.pop()
+        width = len(header)
+        columns = [f"Unnamed: {i}" if name is None else name for i, name in enumerate(header)]
+        batch = []
+        for row in rows:
+            # Blank rows are skipped, as read_excel does.
+            if all(value is None for value in row):
+                continue
+            row = [_excel_value(value) for value in row[:width]]
+            batch.append(row + [None] * (width - len(row)))
+            if len(batch) == chunk_rows:
+                yield _excel_frame(batch, columns)
+                batch = []
+        if batch:
+            yield _excel_frame(batch, columns)
+    finally:
+        workbook.close()
+
+def iter_table(path, chunk_rows, columns=None):
+    # The table in DataFrames of at most chunk_rows rows, so a large input never has to be in memory at once.
+    # Rows are labelled by their position in the whole table, so labels stay unique across chunks.
+    if isinstance(path, pd.DataFrame):
+        chunks = (read_table(path.iloc[start:start + chunk_rows], columns) for start in range(0, len(path), chunk_rows))
+    elif path.endswith('.parquet'):
+        _require_pyarrow()
+        import pyarrow.parquet
+        batches = pyarrow.parquet.ParquetFile(path).iter_batches(batch_size=chunk_rows, columns=columns)
+        chunks = (batch.to_pandas() for batch in batches)
+    elif path.endswith(('.arrow', '.feather')):
+        _require_pyarrow()
+        import pyarrow.ipc
+        reader = pyarrow.ipc.open_file(path)
+        batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+        chunks = (batch.to_pandas()[columns] if columns is not None else batch.to_pandas() for batch in batches)
+    elif path.endswith(EXPORT_EXTENSIONS):
+        chunks = _read_export(path, columns, chunk_rows)
+    elif path.endswith(tuple(TEXT_SEPARATORS)):
+        chunks = pd.read_csv(path, sep=TEXT_SEPARATORS[os.path.splitext(path)[1]], usecols=columns,
+                             chunksize=chunk_rows)
+    elif path.endswith('.xlsx'):
+        chunks = (chunk[columns] if columns is not None else chunk for chunk in _excel_chunks(path, chunk_rows))
+    else:
+        chunks = iter_table(read_table(path, columns), chunk_rows)
+    start = 0
+    for chunk in chunks:
+        chunk.index = pd.RangeIndex(start, start + len(chunk))
+        start += len(chunk)
+        yield chunk
+
+def table_columns(path):
+    # Column names of a table file, read without loading its rows.
+    if path.endswith('.parquet'):
+        _require_pyarrow()
+        import pyarrow.parquet
+        return pyarrow.parquet.read_schema(path).names
+    if path.endswith(('.arrow', '.feather')):
+        _require_pyarrow()
+        import pyarrow.ipc
+        return pyarrow.ipc.open_file(path).schema.names
+    if path.endswith(tuple(TEXT_SEPARATORS)):
+        return pd.read_csv(path, sep=TEXT_SEPARATORS[os.path.splitext(path)[1]], nrows=0).columns.tolist()
+    if path.endswith('.xlsx'):
+        from openpyxl import load_workbook
+        workbook = load_workbook(path, read_only=True)
+        try:
+            header = next(workbook.active.iter_rows(max_row=1, values_only=True), ())
+        finally:
+            workbook.close()
+        return [value for value in header if value is not None]
+    return pd.read_excel(path, nrows=0).columns.tolist()
+
+def decimal_floats(df):
+    # float32 columns (see EXPORT_DTYPES) as the float64 of their shortest decimal form, i.e. the value in the
+    # export, where a plain float64 cast would carry the float32 rounding error (1.39926 -> 1.3992600440979).
+    columns = df.columns[(df.dtypes == 'float32').to_numpy()]
+    if len(columns) == 0:
+        return df
+    df = df.copy()
+    for column in columns:
+        df[column] = df[column].to_numpy().astype(str).astype('float64')
+    return df
+
+def write_table(df, path, sheet_name='Sheet1'):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    if path.endswith('.parquet'):
+        _require_pyarrow()
+        _typed_columns(df).to_parquet(path, index=False)
+    elif path.endswith('.arrow'):
+        _require_pyarrow()
+        _typed_columns(df).reset_index(drop=True).to_feather(path)
+    else:
+        # Excel stores float64 only.
+        decimal_floats(df).to_excel(path, sheet_name=sheet_name, index=False)
+    return path
+
+def _promoted_type(pyarrow, old, new):
+    # Arrow type holding the values of a column typed old in earlier chunks and new in a later one: a column
+    # that was all empty takes the type of its values, numbers become float64, categories stay categories
+    # (with int32 codes, enough for the categories of every chunk) and anything else becomes text.
+    types = pyarrow.types
+    if old == new or types.is_null(new):
+        return old
+    if types.is_null(old):
+        return new
+    if types.is_dictionary(old) and types.is_dictionary(new):
+        return pyarrow.dictionary(pyarrow.int32(), _promoted_type(pyarrow, old.value_type, new.value_type))
+    if (types.is_integer(old) or types.is_floating(old)) and (types.is_integer(new) or types.is_floating(new)):
+        return pyarrow.float64()
+    return pyarrow.large_string()
+
+def _chunk_schema(pyarrow, schema, table):
+    # The schema of the chunks so far (None for the first chunk) widened to hold table too.
+    if schema is None:
+        fields = [field.with_type(pyarrow.dictionary(pyarrow.int32(), field.type.value_type))
+                  if pyarrow.types.is_dictionary(field.type) else field for field in table.schema]
+        return pyarrow.schema(fields, metadata=table.schema.metadata)
+    fields = [field.with_type(_promoted_type(pyarrow, field.type, table.schema.field(field.name).type))
+              for field in schema]
+    return pyarrow.schema(fields, metadata=schema.metadata)
+
+def _table_writer(pyarrow, path, schema, parquet):
+    if parquet:
+        return pyarrow.parquet.ParquetWriter(path, schema)
+    return pyarrow.ipc.new_file(path, schema)
+
+def _extend_dictionaries(pyarrow, dictionaries, table):
+    # Adds the categories of the dictionary columns of table to dictionaries ({column: categories}, in order of
+    # appearance). Returns True if a column got new categories.
+    grew = False
+    for field in table.schema:
+        if pyarrow.types.is_dictionary(field.type):
+            known = dictionaries.get(field.name, pyarrow.array([], field.type.value_type))
+            values = pyarrow.concat_arrays([chunk.dictionary for chunk in table.column(field.name).chunks]).unique()
+            new = values.filter(pyarrow.compute.invert(pyarrow.compute.is_in(values, value_set=known)))
+            if len(new) or field.name not in dictionaries:
+                dictionaries[field.name] = pyarrow.concat_arrays([known, new])
+                grew = True
+    return grew
+
+def _encoded(pyarrow, table, dictionaries):
+    # table with every dictionary column encoded with its categories in dictionaries: an Arrow IPC file holds
+    # a single dictionary per column.
+    for i, field in enumerate(table.schema):
+        if pyarrow.types.is_dictionary(field.type):
+            values = table.column(i).cast(field.type.value_type).combine_chunks()
+            codes = pyarrow.compute.index_in(values, value_set=dictionaries[field.name]).cast(field.type.index_type)
+            table = table.set_column(i, field, pyarrow.DictionaryArray.from_arrays(codes, dictionaries[field.name]))
+    return table
+
+def _written_batches(pyarrow, path, parquet):
+    if parquet:
+        return pyarrow.parquet.ParquetFile(path).iter_batches()
+    reader = pyarrow.ipc.open_file(path)
+    return (reader.get_batch(i) for i in range(reader.num_record_batches))
+
+def write_chunks(chunks, path, sheet_name='Sheet1'):
+    # Writes DataFrames to a single table as they arrive, so the whole table is never in memory.
+    # Every chunk is written with the columns of the first one. Returns the path, or None if there was no chunk.
+    # Parquet and Arrow columns are typed: when a later chunk does not fit the types so far (e.g. text in a
+    # column that was empty until then), the column is widened (see _promoted_type) and the rows already
+    # written are rewritten with it, one batch at a time.
+    columns = None
+    if path.endswith(('.parquet', '.arrow')):
+        pyarrow = _require_pyarrow()
+        import pyarrow.compute
+        import pyarrow.ipc
+        import pyarrow.parquet
+        writer = schema = None
+        parquet = path.endswith('.parquet')
+        # Categories of the dictionary columns of an Arrow file (see _encoded); Parquet keeps those of each chunk.
+        dictionaries = None if parquet else {}
+        rewrites = 0
+        partial_path = path + '.partial'
+        try:
+            for chunk in chunks:
+                if columns is None:
+                    columns = list(chunk.columns)
+                table = pyarrow.Table.from_pandas(_typed_columns(chunk.reindex(columns=columns)), preserve_index=False)
+                chunk_schema = _chunk_schema(pyarrow, schema, table)
+                table = table.cast(chunk_schema)
+                grew = dictionaries is not None and _extend_dictionaries(pyarrow, dictionaries, table)
+                if writer is None:
+                    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+                    writer = _table_writer(pyarrow, partial_path, chunk_schema, parquet)
+                elif grew or not chunk_schema.equals(schema):
+                    writer.close()
+                    rewrites += 1
+                    written_path, partial_path = partial_path, f"{path}.partial{rewrites}"
+                    writer = _table_writer(pyarrow, partial_path, chunk_schema, parquet)
+                    for batch in _written_batches(pyarrow, written_path, parquet):
+                        written = pyarrow.Table.from_batches([batch]).cast(chunk_schema)
+                        writer.write_table(written if dictionaries is None
+                                           else _encoded(pyarrow, written, dictionaries))
+                    os.remove(written_path)
+                schema = chunk_schema
+                writer.write_table(table if dictionaries is None else _encoded(pyarrow, table, dictionaries))
+            if writer is not None:
+                writer.close()
+                writer = None
+                os.replace(partial_path, path)
+        finally:
+            if writer is not None:
+                writer.close()
+                os.remove(partial_path)
+        return path if columns is not None else None
+    from openpyxl import Workbook
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(sheet_name)
+    for chunk in chunks:
+        if columns is None:
+            columns = list(chunk.columns)
+            sheet.append([str(column) for column in columns])
+        chunk = decimal_floats(chunk.reindex(columns=columns))
+        # Missing values are left as empty cells, as to_excel does.
+        for row in chunk.astype(object).where(chunk.notna(), None).itertuples(index=False):
+            sheet.append(list(row))
+    if columns is None:
+        return None
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    workbook.save(path)
+    return path
+
+def list_tables(input_folder, extensions=READABLE_EXTENSIONS):
+    # Paths of the tables in input_folder and its subfolders, relative to input_folder, in sorted order.
+    # Hidden folders (e.g. .ecn_cache) and Excel lock files (~$...) are skipped.
+    tables = []
+    for folder, subfolders, file_names in os.walk(input_folder):
+        subfolders[:] = sorted(subfolder for subfolder in subfolders if not subfolder.startswith('.'))
+        relative_folder = os.path.relpath(folder, input_folder)
+        for file_name in sorted(file_names):
+            if file_name.endswith(extensions) and not file_name.startswith('~$'):
+                tables.append(os.path.normpath(os.path.join(relative_folder, file_name)))
+    return tables
+
+def table_files(input_folder, extensions=READABLE_EXTENSIONS):
+    # {name: path} of the tables found by list_tables. Tables of the same name in different formats (e.g. X.xlsx
+    # and the X.parquet a later run wrote next to it) are one input: the most recently modified file is used.
+    found = {}
+    for file_name in list_tables(input_folder, extensions):
+        found.setdefault(table_name(file_name), []).append(os.path.join(input_folder, file_name))
+    tables = {}
+    for name, paths in found.items():
+        if len(paths) > 1:
+            paths = sorted(paths, key=os.path.getmtime)
+            print(f"Several tables named {name} in {input_folder}: using the newest, {paths[-1]} "
+                  f"(not {', '.join(paths[:-1])})")
+        tables[name] = paths[-1]
+    return tables
+
+def table_name(relative_path):
+    # Name of a table found by list_tables: its relative path without extension, e.g. 'QE/QE-POS-20MIN-Mixture'.
+    # Outputs are written under the same name, so they keep the subfolder layout of the inputs.
+    return os.path.splitext(relative_path)[0]
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
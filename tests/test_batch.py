@@ -0,0 +1,52 @@
+#Tests of the process-pool batch runner (ecn_tool.batch) and of the modules run on it
+import os
+import shutil
+import pandas as pd
+import pytest
+from ecn_tool import msdial, preprocess
+from ecn_tool.batch import run_batch
+from ecn_tool.storage import list_tables
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODEL = os.path.join(ROOT, 'Module1-output-2', 'QE-POS-20MIN-Mixture_processed.xlsx')
+
+def square(value):
+    if value < 0:
+        raise ValueError(f"negative value {value}")
+    return value * value
+
+@pytest.mark.parametrize('workers', [1, 3])
+def test_results_in_task_order_and_errors_kept_per_task(workers):
+    results = run_batch(square, [(str(value), (value,)) for value in (3, -1, 2, 5)], workers)
+    assert [result.name for result in results] == ['3', '-1', '2', '5']
+    assert [result.value for result in results] == [9, None, 4, 25]
+    assert results[1].error is not None and 'negative value -1' in results[1].error
+    assert all(result.error is None for result in results if result.name != '-1')
+
+def copy_inputs(folder, source_folder, file_names):
+    # The inputs in a subfolder, as in the bundled data.
+    os.makedirs(os.path.join(folder, 'QE'))
+    for file_name in file_names:
+        shutil.copy(os.path.join(ROOT, source_folder, 'QE', file_name), os.path.join(folder, 'QE', file_name))
+    return str(folder)
+
+def assert_same_tables(folder, other_folder):
+    files = list_tables(folder)
+    assert files and files == list_tables(other_folder)
+    for file_name in files:
+        pd.testing.assert_frame_equal(pd.read_excel(os.path.join(folder, file_name)),
+                                      pd.read_excel(os.path.join(other_folder, file_name)))
+
+def test_module1_1_serial_and_parallel_write_the_same_tables(tmp_path):
+    inputs = copy_inputs(tmp_path / 'input', 'Module1-input-MSDIAL', ['QE-POS-20MIN-Mixture.xlsx',
+                                                                      'QE-NEG-20MIN-Mixture.xlsx'])
+    for workers in (1, 2):
+        preprocess.main_process(inputs, str(tmp_path / f'workers-{workers}'), workers=workers, incremental=False)
+    assert_same_tables(str(tmp_path / 'workers-1'), str(tmp_path / 'workers-2'))
+
+def test_module3_serial_and_parallel_write_the_same_tables(tmp_path):
+    inputs = copy_inputs(tmp_path / 'input', 'Module3-input-MSDIAL',
+                         ['QE-POS-20MIN-Cell.xlsx', 'QE-POS-20MIN-Yeast.xlsx', 'QE-POS-20MIN-Plasma.xlsx'])
+    for workers in (1, 2):
+        msdial.main_process(inputs, MODEL, str(tmp_path / f'workers-{workers}'), workers=workers, incremental=False)
+    assert_same_tables(str(tmp_path / 'workers-1'), str(tmp_path / 'workers-2'))
@@ -0,0 +1,24 @@
+#Tests of the LipidSearch class conversion of Module2-1 (ecn_tool.class_match)
+import warnings
+import pandas as pd
+from ecn_tool.class_match import classify
+from ecn_tool.classmap import compile_class_map
+
+CLASS_MAP = compile_class_map(pd.DataFrame({'ClassKey': ['PC', 'TG'], 'SubClassKey': ['PC', 'TG'],
+                                            'Ontology': ['PC', 'TG']}))
+
+def test_classify_leaves_the_input_unchanged():
+    df = pd.DataFrame({'ClassKey': ['PC', 'TG'], 'SubClassKey': ['PC', 'TG']})
+    classified, _ = classify(df, CLASS_MAP)
+    assert classified['Ontology'].tolist() == ['PC', 'TG']
+    assert 'Ontology' not in df.columns
+
+def test_classify_after_the_adduct_filter_does_not_warn():
+    df = pd.DataFrame({'ClassKey': ['PC', 'TG', 'PE'], 'SubClassKey': ['PC', 'TG', 'PE'],
+                       'Adduct': ['M+H', 'M+H', 'M+HCOO']})
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        classified, summary = classify(df, CLASS_MAP)
+    assert classified['Ontology'].tolist() == ['PC']
+    assert 'Ontology' not in df.columns
+    assert summary.empty
@@ -0,0 +1,36 @@
+#Tests of the compiled index of class of Module2-1 (ecn_tool.classmap)
+import os
+import pandas as pd
+import pytest
+from ecn_tool import classmap
+
+INDEX = pd.DataFrame({'ClassKey': ['PC', 'TG', 'PC'], 'SubClassKey': ['PC', 'TG', 'PC'],
+                      'Ontology': ['PC', 'TG', 'PE']})
+
+@pytest.fixture
+def index_file(tmp_path):
+    folder = tmp_path / 'index'
+    folder.mkdir()
+    path = folder / 'index of class.xlsx'
+    INDEX.to_excel(path, index=False)
+    classmap._compiled.clear()
+    yield str(path)
+    classmap._compiled.clear()
+
+def test_cache_is_written_to_the_cache_folder_only(index_file, tmp_path):
+    output = tmp_path / 'output'
+    class_map = classmap.load_class_map(index_file, str(output))
+    assert class_map.to_dict() == {('PC', 'PC'): 'PC', ('TG', 'TG'): 'TG'}
+    assert os.listdir(os.path.dirname(index_file)) == ['index of class.xlsx']
+    assert (output / classmap.CACHE_FOLDER / 'index of class.xlsx.classmap.json').exists()
+    classmap._compiled.clear()
+    assert classmap.load_class_map(index_file, str(output)).equals(class_map)
+
+def test_failed_cache_write_is_reported(index_file, tmp_path, capsys):
+    # A file where the cache folder should be makes it impossible to create.
+    blocked = tmp_path / 'blocked'
+    blocked.mkdir()
+    (blocked / classmap.CACHE_FOLDER).write_text('')
+    class_map = classmap.load_class_map(index_file, str(blocked))
+    assert len(class_map) == 2
+    assert 'Could not cache the compiled index of class' in capsys.readouterr().out
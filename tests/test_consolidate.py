@@ -0,0 +1,77 @@
+#Tests of the consolidation of the results of all samples (ecn_tool.consolidate)
+import pandas as pd
+from ecn_tool.consolidate import consolidate, overlap_stats, pair_names, save_consolidated, species_matrix
+
+def lipidsearch_result(rows):
+    # A Module2-2 result: (Ontology, Carbon number, Double bond number, TopRT, Intensity) per row.
+    df = pd.DataFrame(rows, columns=['Ontology', 'Carbon number', 'Double bond number', 'TopRT', 'Intensity'])
+    return df.assign(LipidMolec='x', **{'TheorRT(min)': df['TopRT'], 'δRT(%)': 0.0})
+
+def msdial_result(rows):
+    df = pd.DataFrame(rows, columns=['Ontology', 'Carbon number', 'Double bond number', 'RT (min)', 'Height'])
+    return df.assign(Name='x', **{'TheorRT(min)': df['RT (min)'], 'δRT(%)': 0.0})
+
+def replicates():
+    # Two LipidSearch replicates and one MS-DIAL result of the same sample.
+    lipidsearch = {'QE/QE-POS-20MIN-Cell-1': lipidsearch_result([('PC', 34, 1, 10.0, 100), ('PE', 36, 2, 11.0, 50)]),
+                   'QE/QE-POS-20MIN-Cell-2': lipidsearch_result([('PC', 34, 1, 10.2, 300), ('TG', 52, 2, 20.0, 70)])}
+    msdial = {'QE/QE-POS-20MIN-Cell': msdial_result([('PC', 34, 1, 10.5, 1000), ('SM', 34, 1, 9.0, 10)])}
+    return consolidate(lipidsearch, msdial, workers=1)
+
+def test_replicates_are_separate_samples():
+    long = replicates()
+    assert sorted(long['Sample'].unique()) == ['QE/QE-POS-20MIN-Cell', 'QE/QE-POS-20MIN-Cell-1', 'QE/QE-POS-20MIN-Cell-2']
+    assert set(long['Pair']) == {'QE-POS-20MIN-Cell'}
+    matrix = species_matrix(long).set_index('Species')
+    assert list(matrix.columns[3:]) == ['QE/QE-POS-20MIN-Cell (MS-DIAL)', 'QE/QE-POS-20MIN-Cell-1 (LipidSearch)',
+                                        'QE/QE-POS-20MIN-Cell-2 (LipidSearch)']
+    assert matrix.loc['PC 34:1'].iloc[3:].tolist() == [1000, 100, 300]
+    assert pd.isna(matrix.loc['TG 52:2', 'QE/QE-POS-20MIN-Cell-1 (LipidSearch)'])
+
+def test_matrix_keeps_the_largest_of_duplicate_rows():
+    long = replicates()
+    doubled = pd.concat([long, long.assign(Intensity=long['Intensity'] * 2)], ignore_index=True)
+    matrix = species_matrix(doubled).set_index('Species')
+    assert matrix.loc['PC 34:1', 'QE/QE-POS-20MIN-Cell-1 (LipidSearch)'] == 200
+
+def test_overlap_pairs_replicates_with_their_msdial_result():
+    overlap = overlap_stats(replicates()).set_index(['Pair', 'Ontology'])
+    pc = overlap.loc[('QE-POS-20MIN-Cell', 'PC')]
+    assert (pc['Both'], pc['MS-DIAL only'], pc['LipidSearch only']) == (1, 0, 0)
+    # The RT of the most intense LipidSearch replicate (10.2) is compared.
+    assert pc['Median ΔRT (min)'] == 0.3
+    assert overlap.loc[('QE-POS-20MIN-Cell', 'TG'), 'LipidSearch only'] == 1
+    assert overlap.loc[('QE-POS-20MIN-Cell', 'SM'), 'MS-DIAL only'] == 1
+    assert overlap.loc[('All', 'PC'), 'Both'] == 1
+
+def test_results_in_differently_named_subfolders_pair():
+    # As in Module2-output-2 and Module3-output, e.g. QE/ and QE-5%/, Astral/ and Astral-5%/.
+    lipidsearch = {'QE/QE-POS-20MIN-Cell-1': lipidsearch_result([('PC', 34, 1, 10.0, 100)]),
+                   'Astral/Astral_POS_Cell-25': lipidsearch_result([('PC', 34, 1, 10.0, 100)])}
+    msdial = {'QE-5%/QE-POS-20MIN-Cell': msdial_result([('PC', 34, 1, 10.1, 1000)]),
+              'Astral-5%/Astral_POS_Cell-25': msdial_result([('PC', 34, 1, 10.1, 1000)])}
+    overlap = overlap_stats(consolidate(lipidsearch, msdial, workers=1)).set_index(['Pair', 'Ontology'])
+    # The gradient number of the Astral names is on both sides, so it is kept.
+    assert overlap.loc[('QE-POS-20MIN-Cell', 'PC'), 'Both'] == 1
+    assert overlap.loc[('Astral_POS_Cell-25', 'PC'), 'Both'] == 1
+    assert overlap.loc[('All', 'PC'), 'Both'] == 2
+
+def test_only_a_differing_run_number_is_left_out():
+    pairs = pair_names(['Astral_POS_Cell-25-1', 'Astral_POS_Cell-25-2', 'QE-POS-20MIN-Yeast-1'],
+                       ['Astral_POS_Cell-25', 'QE-POS-20MIN-Yeast-2', 'QE-NEG-20MIN-Yeast'])
+    assert pairs == {('LipidSearch', 'Astral_POS_Cell-25-1'): 'Astral_POS_Cell-25',
+                     ('LipidSearch', 'Astral_POS_Cell-25-2'): 'Astral_POS_Cell-25',
+                     ('LipidSearch', 'QE-POS-20MIN-Yeast-1'): 'QE-POS-20MIN-Yeast',
+                     ('MS-DIAL', 'Astral_POS_Cell-25'): 'Astral_POS_Cell-25',
+                     ('MS-DIAL', 'QE-POS-20MIN-Yeast-2'): 'QE-POS-20MIN-Yeast',
+                     ('MS-DIAL', 'QE-NEG-20MIN-Yeast'): 'QE-NEG-20MIN-Yeast'}
+
+def test_no_pair_is_reported(capsys):
+    pair_names(['QE-POS-20MIN-Cell-1'], ['QE-NEG-20MIN-Cell'])
+    assert 'no LipidSearch result has the instrument, polarity and sample' in capsys.readouterr().out
+    pair_names(['QE-POS-20MIN-Cell-1'], [])
+    assert capsys.readouterr().out == ''
+
+def test_save_consolidated_writes_the_three_sheets(tmp_path):
+    path = save_consolidated(replicates(), str(tmp_path / 'consolidated.xlsx'))
+    assert list(pd.read_excel(path, sheet_name=None)) == ['Long', 'Matrix', 'Overlap']
@@ -0,0 +1,41 @@
+#Tests of the construction of ECN models of Module1-2 (ecn_tool.construction)
+import os
+import pandas as pd
+from ecn_tool import construction
+from ecn_tool.storage import list_tables, read_table
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Largest first, so with several workers the files finish in another order than they were given.
+TRAINING = ['Astral/Astral_POS_Mixture-25', 'QE/QE-NEG-20MIN-Mixture', 'Astral/Astral_NEG_Mixture-25',
+            'QE/QE-POS-20MIN-Mixture']
+
+def training_frames():
+    return {name: os.path.join(ROOT, 'Module1-output-1', name + '.xlsx') for name in TRAINING}
+
+def test_models_do_not_depend_on_the_number_of_workers(tmp_path):
+    results = {workers: construction.process_folder(None, str(tmp_path / f'workers-{workers}'),
+                                                    frames=training_frames(), workers=workers, incremental=False)
+               for workers in (1, 3)}
+    assert list(results[1]) == list(results[3]) == TRAINING
+    for name in TRAINING:
+        pd.testing.assert_frame_equal(results[1][name], results[3][name])
+    files = list_tables(str(tmp_path / 'workers-1'), ('_processed.xlsx', '_processed.json'))
+    assert len(files) == 2 * len(TRAINING) and files == list_tables(str(tmp_path / 'workers-3'),
+                                                                    ('_processed.xlsx', '_processed.json'))
+    for file_name in files:
+        paths = [os.path.join(tmp_path, f'workers-{workers}', file_name) for workers in (1, 3)]
+        if file_name.endswith('.json'):
+            with open(paths[0], encoding='utf-8') as serial, open(paths[1], encoding='utf-8') as parallel:
+                assert serial.read() == parallel.read()
+        else:
+            pd.testing.assert_frame_equal(read_table(paths[0]), read_table(paths[1]))
+
+def test_groups_of_one_file_fitted_in_parallel_are_in_the_serial_order():
+    data = read_table(os.path.join(ROOT, 'Module1-output-1', 'Astral', 'Astral_POS_Mixture-25.xlsx'))
+    data['Carbon number'] = pd.to_numeric(data['Carbon number'], errors='coerce')
+    data = data.dropna(subset=['Carbon number']).astype({'Carbon number': float})
+    serial = construction.fit_groups(data, 1)
+    parallel = construction.fit_groups(data, 3)
+    assert [(fit['Ontology'], fit['Double bond number']) for fit in serial] == \
+        [(fit['Ontology'], fit['Double bond number']) for fit in parallel]
+    assert [fit['Equation'] for fit in serial] == [fit['Equation'] for fit in parallel]
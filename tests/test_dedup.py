@@ -0,0 +1,42 @@
+#Tests of the keep-the-maximum deduplication (ecn_tool.dedup) and its use by Module2-2
+import pandas as pd
+from ecn_tool import lipidsearch
+from ecn_tool.dedup import keep_max_rows, keep_max_rows_chunks
+
+def species():
+    # Class is categorical with categories that have no rows (PE, DG), as dedup_species builds it.
+    return pd.DataFrame({'Class': pd.Categorical(['TG', 'PC', 'TG', 'PC', None], categories=['TG', 'PC', 'PE', 'DG']),
+                         'Chains': ['16:0_18:1', '18:1', '16:0_18:1', '18:1', '18:2'],
+                         'Intensity': [1.0, 5.0, 3.0, 2.0, 9.0]})
+
+def test_keep_max_rows_skips_unobserved_categories():
+    kept, duplicates = keep_max_rows(species(), ['Class', 'Chains'], 'Intensity')
+    assert kept.index.tolist() == [2, 1]
+    assert duplicates['Class'].astype(str).tolist() == ['TG', 'PC']
+    assert duplicates['Rows'].tolist() == [2, 2]
+    assert duplicates['Max Intensity'].tolist() == [3.0, 5.0]
+
+def test_keep_max_rows_chunks_matches_keep_max_rows():
+    df = species()
+    kept, duplicates = keep_max_rows_chunks([df.iloc[:2], df.iloc[2:]], ['Class', 'Chains'], 'Intensity')
+    whole_kept, whole_duplicates = keep_max_rows(df, ['Class', 'Chains'], 'Intensity')
+    pd.testing.assert_frame_equal(kept, whole_kept)
+    pd.testing.assert_frame_equal(duplicates, whole_duplicates)
+
+def test_dedup_species_keeps_the_max_intensity_row():
+    df = pd.DataFrame({'ClassKey': ['TG', 'TG', 'PC', 'SM'],
+                       'LipidMolec': ['TG(16:0_18:1_18:2)', 'TG(18:1_16:0_18:2)', 'PC(16:0_18:1)', 'SM(d18:1_16:0)'],
+                       'Intensity': [1.0, 2.0, 3.0, 4.0]})
+    assert sorted(lipidsearch.dedup_species(df)['Intensity'].tolist()) == [2.0, 3.0, 4.0]
+
+def test_failed_file_is_a_batch_error(tmp_path, monkeypatch, capsys):
+    def fail(*args):
+        raise RuntimeError('dedup failed')
+    monkeypatch.setattr(lipidsearch, 'filter_matches', fail)
+    model = pd.DataFrame({'Ontology': ['PC'], 'Double bond number': [1], 'Equation': ['y=0.5x+1']})
+    sample = pd.DataFrame({'Ontology': ['PC'], 'LipidGroupKey': ['PC 16:1'], 'LipidMolec': ['PC(16:1)'],
+                           'ClassKey': ['PC'], 'TopRT': [9.0], 'Intensity': [1.0]})
+    results = lipidsearch.main_process(None, lipidsearch.read_index_table(model), str(tmp_path),
+                                       frames={'sample': sample}, workers=1, incremental=False)
+    assert results == {}
+    assert 'Error processing sample' in capsys.readouterr().out
@@ -0,0 +1,63 @@
+#Tests of the least-squares fits used to build the ECN models (ecn_tool.fitting)
+import numpy as np
+import pytest
+from ecn_tool.fitting import OutlierFit, batch_linear_fit
+
+# Coefficients agree with a fresh least-squares fit of the remaining points to 1e-9 (relative to the largest
+# coefficient); the Equations of the models are written with 4 decimals.
+TOLERANCE = 1e-9
+
+def training_group(seed=0):
+    # Carbon numbers and RTs (3 decimals, as exported by MS-DIAL) of a TG-like group, with outliers.
+    rng = np.random.default_rng(seed)
+    x = np.arange(36.0, 62.0)
+    y = np.round(-0.0035 * x ** 2 + 0.5469 * x - 5.4278 + rng.normal(0, 0.02, len(x)), 3)
+    y[[3, 11, 20]] += [0.8, -0.6, 0.5]
+    return x, y
+
+def lstsq(x, y, degree):
+    design = np.stack([x ** power for power in range(degree, -1, -1)], axis=1)
+    return np.linalg.lstsq(design, y, rcond=None)[0]
+
+def assert_close(actual, expected):
+    assert np.max(np.abs(actual - expected)) <= TOLERANCE * np.max(np.abs(expected))
+
+@pytest.mark.parametrize('seed', range(5))
+def test_fits_after_removals_match_a_fresh_fit(seed):
+    x, y = training_group(seed)
+    fit = OutlierFit(x, y)
+    for _ in range(8):
+        popt, residuals, _ = fit.quadratic()
+        fit.remove(np.argmax(np.abs(residuals)))
+        assert len(fit) == len(fit.x) == len(fit.y)
+        assert_close(fit.linear()[0], lstsq(fit.x, fit.y, 1))
+        assert_close(fit.quadratic()[0], lstsq(fit.x, fit.y, 2))
+    # The points removed are the outliers, then the largest residuals.
+    assert not {39.0, 47.0, 56.0} & set(fit.x)
+
+def test_residuals_and_r2_are_those_of_the_remaining_points():
+    x, y = training_group()
+    fit = OutlierFit(x, y)
+    fit.remove(3)
+    fit.remove(-1)
+    popt, residuals, r2 = fit.quadratic()
+    expected = fit.y - np.polyval(popt, fit.x)
+    np.testing.assert_allclose(residuals, expected, atol=1e-12)
+    assert r2 == pytest.approx(1 - np.sum(expected ** 2) / np.sum((fit.y - fit.y.mean()) ** 2))
+
+def test_too_few_points():
+    fit = OutlierFit([40.0, 42.0, 44.0], [10.0, 10.5, 11.2])
+    fit.remove(0)
+    assert_close(fit.linear()[0], np.array([0.35, -4.2]))
+    with pytest.raises(ValueError):
+        fit.quadratic()
+    with pytest.raises(ValueError):
+        OutlierFit([40.0, np.nan], [10.0, 10.5])
+
+def test_batch_linear_fit_matches_per_group_fits():
+    x, y = training_group()
+    codes = np.repeat([0, 1, -1], [10, 10, len(x) - 20])
+    slope, intercept, n = batch_linear_fit(codes, x, y, 2)
+    for group in (0, 1):
+        assert_close(np.array([slope[group], intercept[group]]), lstsq(x[codes == group], y[codes == group], 1))
+    assert n.tolist() == [10, 10]
@@ -0,0 +1,31 @@
+#Tests of the instrumentation of the stages (ecn_tool.instrument)
+import sys
+import numpy as np
+import pytest
+from ecn_tool import instrument
+
+@pytest.fixture
+def enabled():
+    instrument.enable()
+    yield
+    instrument.disable()
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason='the per-step peak is measured on Linux only')
+def test_step_peak_is_that_of_the_step(enabled):
+    with instrument.task('stage', 'large'):
+        with instrument.step('allocate'):
+            array = np.ones(40_000_000)  # 320 MB
+            del array
+        with instrument.step('after'):
+            pass
+    with instrument.task('stage', 'small'):
+        with instrument.step('after'):
+            pass
+    peaks = {(event['file'], event['step']): event for event in instrument.events()}
+    allocate = peaks['large', 'allocate']['peak_rss_mb']
+    assert allocate - peaks['large', 'after']['peak_rss_mb'] > 250
+    assert allocate - peaks['small', 'total']['peak_rss_mb'] > 250
+    # An outer step includes the peaks of the steps within it.
+    assert peaks['large', 'total']['peak_rss_mb'] >= allocate
+    # The process peak is cumulative.
+    assert peaks['small', 'total']['process_peak_rss_mb'] >= allocate
@@ -0,0 +1,86 @@
+#Tests of the incremental runs of the modules (ecn_tool.manifest)
+import os
+import shutil
+import pandas as pd
+import pytest
+from ecn_tool import construction, msdial, preprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODEL = os.path.join(ROOT, 'Module1-output-2', 'QE-POS-20MIN-Mixture_processed.xlsx')
+OTHER_MODEL = os.path.join(ROOT, 'Module1-output-2', 'Astral_POS_Mixture-25_processed.xlsx')
+INPUTS = ['QE-POS-20MIN-Cell.xlsx', 'QE-POS-20MIN-Yeast.xlsx']
+
+@pytest.fixture
+def inputs(tmp_path):
+    folder = tmp_path / 'input' / 'QE'
+    folder.mkdir(parents=True)
+    for file_name in INPUTS:
+        shutil.copy(os.path.join(ROOT, 'Module3-input-MSDIAL', 'QE', file_name), folder / file_name)
+    return str(tmp_path / 'input')
+
+def redone(results):
+    # Names of the inputs processed by a run; a skipped input gives the path of its earlier result instead.
+    return sorted(name for name, result in results.items() if isinstance(result, pd.DataFrame))
+
+def run(inputs, output, model=MODEL, tolerance=5.0):
+    return msdial.main_process(inputs, model, output, workers=1, tolerance=tolerance)
+
+def test_unchanged_inputs_are_skipped(inputs, tmp_path, capsys):
+    output = str(tmp_path / 'output')
+    assert redone(run(inputs, output)) == ['QE/QE-POS-20MIN-Cell', 'QE/QE-POS-20MIN-Yeast']
+    results = run(inputs, output)
+    assert redone(results) == []
+    assert results['QE/QE-POS-20MIN-Cell'] == os.path.join(output, 'QE', 'QE-POS-20MIN-Cell_processed.xlsx')
+    assert 'Skipped 2 file(s) unchanged' in capsys.readouterr().out
+
+def test_changed_content_is_redone(inputs, tmp_path):
+    output = str(tmp_path / 'output')
+    run(inputs, output)
+    path = os.path.join(inputs, 'QE', 'QE-POS-20MIN-Cell.xlsx')
+    # Same name and columns, one row fewer.
+    pd.read_excel(path).iloc[1:].to_excel(path, index=False)
+    assert redone(run(inputs, output)) == ['QE/QE-POS-20MIN-Cell']
+
+def test_touched_but_unchanged_input_is_skipped(inputs, tmp_path):
+    output = str(tmp_path / 'output')
+    run(inputs, output)
+    path = os.path.join(inputs, 'QE', 'QE-POS-20MIN-Cell.xlsx')
+    os.utime(path, (1, 1))
+    assert redone(run(inputs, output)) == []
+
+def test_changed_settings_or_model_are_redone(inputs, tmp_path):
+    output = str(tmp_path / 'output')
+    run(inputs, output)
+    assert redone(run(inputs, output, tolerance=3.0)) == ['QE/QE-POS-20MIN-Cell', 'QE/QE-POS-20MIN-Yeast']
+    assert redone(run(inputs, output, tolerance=3.0)) == []
+    assert redone(run(inputs, output, OTHER_MODEL, 3.0)) == ['QE/QE-POS-20MIN-Cell', 'QE/QE-POS-20MIN-Yeast']
+
+def test_deleted_output_is_redone(inputs, tmp_path):
+    output = str(tmp_path / 'output')
+    run(inputs, output)
+    os.remove(os.path.join(output, 'QE', 'QE-POS-20MIN-Yeast_processed.xlsx'))
+    assert redone(run(inputs, output)) == ['QE/QE-POS-20MIN-Yeast']
+    assert os.path.exists(os.path.join(output, 'QE', 'QE-POS-20MIN-Yeast_processed.xlsx'))
+
+def test_changed_output_format_is_redone(tmp_path):
+    pytest.importorskip('pyarrow')
+    source = os.path.join(ROOT, 'Module1-input-MSDIAL', 'QE', 'QE-NEG-20MIN-Mixture.xlsx')
+    output = str(tmp_path / 'output')
+    frames = {'QE/QE-NEG-20MIN-Mixture': source}
+    def run_module1_1(output_format='xlsx'):
+        return redone(preprocess.main_process(None, output, output_format, frames=frames, workers=1))
+    assert run_module1_1() == ['QE/QE-NEG-20MIN-Mixture']
+    assert run_module1_1() == []
+    assert run_module1_1('parquet') == ['QE/QE-NEG-20MIN-Mixture']
+
+def test_unchanged_training_data_is_not_refitted(tmp_path, capsys):
+    frames = {'QE-NEG-20MIN-Mixture': os.path.join(ROOT, 'Module1-output-1', 'QE', 'QE-NEG-20MIN-Mixture.xlsx')}
+    output = str(tmp_path / 'model')
+    built = construction.process_folder(None, output, frames=frames, workers=1)['QE-NEG-20MIN-Mixture']
+    model_file = os.path.join(output, 'QE-NEG-20MIN-Mixture_processed.xlsx')
+    modified = os.path.getmtime(model_file)
+    capsys.readouterr()
+    cached = construction.process_folder(None, output, frames=frames, workers=1)['QE-NEG-20MIN-Mixture']
+    assert 'Skipped 1 file(s) unchanged' in capsys.readouterr().out
+    assert os.path.getmtime(model_file) == modified
+    pd.testing.assert_frame_equal(cached[['Ontology', 'Equation']], built[['Ontology', 'Equation']])
@@ -0,0 +1,87 @@
+#Tests of the matching of features to the ECN models through the theoretical-RT grid (ecn_tool.matching)
+import json
+import os
+import numpy as np
+import pandas as pd
+from ecn_tool import construction
+from ecn_tool.matching import RTGrid, match_table
+from ecn_tool.model import CARBON_RANGE_COLUMNS, add_coefficients, load_model, theoretical_rt
+
+# TG turns over at carbon number 78 (past its fitted range), CAR at 12 (before it).
+MODELS = [('TG', 1, 'Quadratic', [-0.0035, 0.5469, -5.4278], 36, 60),
+          ('CAR', 0, 'Quadratic', [0.0231, -0.5598, 4.7880], 14, 18),
+          ('PC', 1, 'Linear', [0.0, 0.5, 1.0], 30, 40)]
+
+def index_table(with_range=True):
+    rows = [{'Ontology': ontology, 'Double bond number': double_bond, 'Fit Type': fit_type,
+             'Equation': f"y = {a}x^2 + {b}x + {c}", 'X_R_data': str([float(low), float(high)]) if with_range else None}
+            for ontology, double_bond, fit_type, (a, b, c), low, high in MODELS]
+    return add_coefficients(pd.DataFrame(rows))
+
+def theor(ontology, carbon):
+    a, b, c = next(coefficients for name, _, _, coefficients, _, _ in MODELS if name == ontology)
+    return theoretical_rt(a, b, c, carbon)
+
+def features(*rows):
+    return pd.DataFrame(rows, columns=['Ontology', 'Double bond number', 'Carbon number', 'RT (min)'])
+
+def test_same_carbon_matches_the_carbon_number_of_the_name_only():
+    matched = match_table(features(('PC', 1, 34, 18.0), ('PC', 1, 36, 18.0)), RTGrid(index_table()), 'RT (min)')
+    assert matched['Carbon number'].tolist() == [34]
+    assert matched['TheorRT(min)'].tolist() == [18.0]
+
+def test_top_k_ranks_the_closest_carbon_numbers_first():
+    grid = RTGrid(index_table())
+    matched = match_table(features(('PC', 1, 34, 18.1)), grid, 'RT (min)', top_k=2, same_carbon=False)
+    assert matched['ECN carbon number'].tolist() == [34, 35]
+    assert matched['Rank'].tolist() == [1, 2]
+    every = match_table(features(('PC', 1, 34, 18.1)), grid, 'RT (min)', same_carbon=False)
+    assert sorted(every['ECN carbon number'].tolist()) == [33, 34, 35, 36]
+
+def test_alternatives_stay_within_the_fitted_carbon_range():
+    grid = RTGrid(index_table())
+    matched = match_table(features(('TG', 1, 60, theor('TG', 60)), ('CAR', 0, 14, theor('CAR', 14))), grid,
+                          'RT (min)', top_k=3, same_carbon=False)
+    assert matched['ECN carbon number'].tolist() == [60, 59, 58, 14]
+    # The other branches of the parabolas (TG 96, CAR 10) are within the window but never fitted.
+    assert abs(theor('TG', 96) - theor('TG', 60)) / theor('TG', 60) < 0.05
+    assert abs(theor('CAR', 10) - theor('CAR', 14)) / theor('CAR', 14) < 0.05
+
+def test_alternatives_stop_at_the_vertex_without_a_fitted_range():
+    matched = match_table(features(('TG', 1, 60, theor('TG', 60)), ('CAR', 0, 14, theor('CAR', 14))),
+                          RTGrid(index_table(with_range=False)), 'RT (min)', same_carbon=False)
+    tg = matched.loc[matched['Ontology'] == 'TG', 'ECN carbon number']
+    car = matched.loc[matched['Ontology'] == 'CAR', 'ECN carbon number']
+    assert 60 in tg.tolist() and tg.max() <= 78
+    assert 14 in car.tolist() and car.min() >= 13
+
+def test_same_carbon_is_not_limited_to_the_fitted_range():
+    matched = match_table(features(('PC', 1, 50, 26.0)), RTGrid(index_table()), 'RT (min)')
+    assert matched['TheorRT(min)'].tolist() == [26.0]
+
+def test_json_model_keeps_its_carbon_range(tmp_path):
+    path = tmp_path / 'model_processed.json'
+    path.write_text(json.dumps({'format': 'ecn-model', 'version': 1, 'source': {}, 'models': [
+        {'Ontology': 'TG', 'Double bond number': 1, 'Fit Type': 'Quadratic', 'coefficients': MODELS[0][3],
+         'r2': 0.999, 'carbon_min': 36.0, 'carbon_max': 60.0, 'n_points': 20, 'residual_std': 0.01}]}))
+    model = load_model(str(path))
+    matched = match_table(features(('TG', 1, 60, theor('TG', 60))), RTGrid(model), 'RT (min)', same_carbon=False)
+    assert matched['ECN carbon number'].max() == 60
+    assert 'ECN carbon min' not in matched.columns
+
+def test_tolerance_in_minutes():
+    grid = RTGrid(index_table())
+    rt = np.array([18.0, 18.25, 18.35])
+    matched = match_table(features(*[('PC', 1, 34, value) for value in rt]), grid, 'RT (min)', 0.3, 'min')
+    assert matched['RT (min)'].tolist() == [18.0, 18.25]
+    # The default window, 5% of the RT, is wider here than 0.3 min.
+    assert len(match_table(features(('PC', 1, 34, 18.35)), grid, 'RT (min)')) == 1
+
+def test_built_and_cached_models_keep_their_carbon_range(tmp_path):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    frames = {'QE-POS-20MIN-Mixture': os.path.join(root, 'Module1-output-1', 'QE', 'QE-POS-20MIN-Mixture.xlsx')}
+    built = construction.process_folder(None, str(tmp_path), frames=frames, workers=1)['QE-POS-20MIN-Mixture']
+    cached = construction.process_folder(None, str(tmp_path), frames=frames, workers=1)['QE-POS-20MIN-Mixture']
+    tg = built[(built['Ontology'] == 'TG') & (built['Double bond number'].astype(str) == '1')]
+    assert tg[CARBON_RANGE_COLUMNS].values.tolist() == [[36.0, 60.0]]
+    np.testing.assert_array_equal(cached[CARBON_RANGE_COLUMNS].to_numpy(), built[CARBON_RANGE_COLUMNS].to_numpy())
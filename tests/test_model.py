@@ -0,0 +1,50 @@
+#Tests of the ECN equations and model files (ecn_tool.model)
+import numpy as np
+import pandas as pd
+import pytest
+from ecn_tool.model import add_coefficients, evaluate, format_equation, parse_equation
+
+@pytest.mark.parametrize('equation, coefficients', [
+    ('y = 0.2198x + 2.5335', (0.0, 0.2198, 2.5335)),
+    ('y = 0.0511x^2 + -3.9965x + 82.6903', (0.0511, -3.9965, 82.6903)),
+    ('y = -0.0035x^2 + 0.5469x + -5.4278', (-0.0035, 0.5469, -5.4278)),
+    ('y = -0.7422x^2 + 59.3122x - 1176.4835', (-0.7422, 59.3122, -1176.4835)),
+    ('y=1.5e-3x**2-2E+1*x+.5', (1.5e-3, -20.0, 0.5)),
+    ('y = x^2 - x', (1.0, -1.0, 0.0)),
+    ('0.5x + 1', (0.0, 0.5, 1.0)),
+    ('y = 3', (0.0, 0.0, 3.0)),
+])
+def test_parse_equation(equation, coefficients):
+    assert parse_equation(equation) == pytest.approx(coefficients)
+
+@pytest.mark.parametrize('equation', [
+    'y = 0.5x^3 + 1',
+    'y = 0.5x 1',
+    'y = 0.5*y + 1',
+    'y = 0.5x + abc',
+    'y = 1 + exp(2)',
+    'y = __import__("os")',
+    '',
+    'y = ',
+    None,
+    1.5,
+])
+def test_parse_equation_rejects_malformed_equations(equation):
+    with pytest.raises(ValueError):
+        parse_equation(equation)
+
+@pytest.mark.parametrize('fit_type, coefficients', [('Linear', (0.0, 0.2198, 2.5335)),
+                                                    ('Quadratic', (-0.0035, 0.5469, -5.4278))])
+def test_parse_equation_reads_format_equation(fit_type, coefficients):
+    assert parse_equation(format_equation(fit_type, coefficients)) == pytest.approx(coefficients)
+
+def test_add_coefficients_and_evaluate():
+    table = pd.DataFrame({'Ontology': ['TG', 'PC', 'PE'],
+                          'Equation': ['y = -0.0035x^2 + 0.5469x + -5.4278', 'y = 0.5x + 1', 'y = 0.5x +']})
+    table = add_coefficients(table)
+    # A malformed Equation gets no coefficients, so it never matches.
+    assert np.isnan(table.loc[2, ['ECN a', 'ECN b', 'ECN c']].to_numpy(dtype=float)).all()
+    table['Carbon number'] = [60, 34, 34]
+    rt = evaluate(table)
+    assert rt[:2] == pytest.approx([-0.0035 * 3600 + 0.5469 * 60 - 5.4278, 18.0])
+    assert np.isnan(rt[2])
@@ -0,0 +1,71 @@
+#Tests of ecn run (ecn_tool.pipeline and ecn_tool.cli) on the bundled data
+import os
+import shutil
+import pandas as pd
+from ecn_tool import INDEX_OF_CLASS, cli
+from ecn_tool.pipeline import OUTPUT_FOLDERS, collect_inputs, run_pipeline
+from ecn_tool.storage import list_tables
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LIPIDSEARCH = os.path.join(ROOT, 'Module2-input-lipidsearch')
+MSDIAL = os.path.join(ROOT, 'Module3-input-MSDIAL')
+MODELS = os.path.join(ROOT, 'Module1-output-2')
+
+def test_collect_inputs_keeps_same_named_inputs_of_both_kinds():
+    inputs = collect_inputs([LIPIDSEARCH, MSDIAL])
+    assert len(inputs['lipidsearch']) == 20
+    assert len(inputs['msdial']) == 20
+    assert 'Astral/Astral_NEG_Cell-25' in inputs['lipidsearch']
+    assert 'Astral/Astral_NEG_Cell-25' in inputs['msdial']
+
+def test_run_over_both_input_roots(tmp_path):
+    results = run_pipeline(MODELS, [LIPIDSEARCH, MSDIAL], str(tmp_path), intermediate=False)
+    assert len(results['lipidsearch']) == 20
+    assert len(results['msdial']) == 20
+    for kind in ('lipidsearch', 'msdial'):
+        outputs = list_tables(os.path.join(tmp_path, OUTPUT_FOLDERS[kind]), ('_processed.xlsx',))
+        assert len(outputs) == 20
+        assert os.path.join('Astral', 'Astral_NEG_Cell-25_processed.xlsx') in outputs
+
+def test_index_of_class_default_is_independent_of_working_folder(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    args = cli.build_parser().parse_args(['run', '--model', MODELS, '--inputs', MSDIAL])
+    assert args.index_of_class == INDEX_OF_CLASS
+    assert os.path.exists(args.index_of_class)
+
+def test_index_of_class_needed_only_for_lipidsearch_inputs(tmp_path):
+    missing = str(tmp_path / 'missing.xlsx')
+    msdial_file = os.path.join(MSDIAL, 'QE', 'QE-POS-20MIN-Cell.xlsx')
+    lipidsearch_file = os.path.join(LIPIDSEARCH, 'QE', 'QE-POS-20MIN-Cell-1.xlsx')
+    run = ['run', '--model', MODELS, '--index-of-class', missing, '--output', str(tmp_path), '--no-intermediate']
+    assert cli.main(run + ['--inputs', msdial_file]) == 0
+    assert cli.main(run + ['--inputs', lipidsearch_file]) == 1
+
+def test_text_exports_give_the_same_results_as_excel(tmp_path):
+    inputs = {'txt': [], 'xlsx': [os.path.join(LIPIDSEARCH, 'QE', 'QE-POS-20MIN-Cell-1.xlsx'),
+                                  os.path.join(MSDIAL, 'QE', 'QE-POS-20MIN-Cell.xlsx')]}
+    for path in inputs['xlsx']:
+        text_path = str(tmp_path / (os.path.basename(path)[:-len('.xlsx')] + '.txt'))
+        pd.read_excel(path).to_csv(text_path, sep='\t', index=False)
+        inputs['txt'].append(text_path)
+    results = {fmt: run_pipeline(MODELS, paths, str(tmp_path / fmt), intermediate=False, incremental=False)
+               for fmt, paths in inputs.items()}
+    for kind in ('lipidsearch', 'msdial'):
+        (text_result,), (excel_result,) = results['txt'][kind].values(), results['xlsx'][kind].values()
+        columns = [column for column in excel_result.columns if column in text_result.columns]
+        pd.testing.assert_frame_equal(text_result[columns].reset_index(drop=True).astype(excel_result[columns].dtypes),
+                                      excel_result[columns].reset_index(drop=True))
+
+def test_pool_matches_with_the_pooled_models(tmp_path, capsys):
+    # A model of an earlier run without --pool is left in Module1-output-2, and is newer than the pooled one.
+    training = os.path.join(ROOT, 'Module1-input-MSDIAL', 'QE', 'QE-POS-20MIN-Mixture.xlsx')
+    model_folder = tmp_path / OUTPUT_FOLDERS['model']
+    model_folder.mkdir()
+    results = run_pipeline(training, [os.path.join(MSDIAL, 'QE', 'QE-POS-20MIN-Cell.xlsx')], str(tmp_path),
+                           intermediate=False, pool=True)
+    assert results['model'] == str(model_folder / 'pooled')
+    shutil.copy(os.path.join(MODELS, 'QE-POS-20MIN-Mixture_processed.xlsx'), model_folder)
+    capsys.readouterr()
+    run_pipeline(training, [os.path.join(MSDIAL, 'QE', 'QE-POS-20MIN-Cell.xlsx')], str(tmp_path),
+                 intermediate=False, incremental=False, pool=True)
+    assert 'ECN model QE-POS-pooled_processed.json: 1 file(s)' in capsys.readouterr().out
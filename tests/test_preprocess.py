@@ -0,0 +1,28 @@
+#Tests of the preprocess of MS-DIAL lipid data (ecn_tool.preprocess)
+import pandas as pd
+import pytest
+from ecn_tool.preprocess import filter_by_max_height, filter_by_max_height_chunks, process_lipid_group_key
+
+def export():
+    return pd.DataFrame({'Name': ['PC 34:1', 'PC 34:1', 'CoQ10', 'Inosine', 'TG 16:0_18:1_18:1', 'Inosine', None],
+                         'Ontology': ['PC', 'PC', 'CoQ', 'Others', 'TG', 'Others', 'Others'],
+                         'RT (min)': [10.1, 10.3, 5.0, 9.9, 20.0, 6.0, 7.0],
+                         'Height': [100.0, 300.0, 900.0, 800.0, 50.0, 700.0, 600.0]})
+
+def test_names_without_carbon_double_bond_are_their_own_species():
+    df = process_lipid_group_key(export())
+    assert df['Carbon number'].tolist()[:5] == [34, 34, 'CoQ10', 'Inosine', 16]
+    assert df['Double bond number'].tolist()[:5] == [1, 1, 'CoQ10', 'Inosine', 0]
+    assert df[['Carbon number', 'Double bond number']].iloc[-1].isna().all()
+
+@pytest.mark.parametrize('chunk_rows', [None, 2])
+def test_max_height_keeps_names_without_carbon_double_bond(chunk_rows):
+    df = export()
+    if chunk_rows:
+        chunks = (process_lipid_group_key(df.iloc[i:i + chunk_rows].copy()) for i in range(0, len(df), chunk_rows))
+        processed = filter_by_max_height_chunks(chunks)
+    else:
+        processed = filter_by_max_height(process_lipid_group_key(df))
+    # A row without a Name has no species, as in the original Module1-1.
+    assert sorted(zip(processed['Name'], processed['Height'])) == [
+        ('CoQ10', 900.0), ('Inosine', 800.0), ('PC 34:1', 300.0), ('TG 16:0_18:1_18:1', 50.0)]
@@ -0,0 +1,59 @@
+#Tests of the registry of ECN models (ecn_tool.registry)
+import os
+import shutil
+import pytest
+from ecn_tool import construction, msdial
+from ecn_tool.registry import ModelRegistry, select_models
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TRAINING = os.path.join(ROOT, 'Module1-output-1', 'QE', 'QE-POS-20MIN-Mixture.xlsx')
+
+@pytest.fixture(scope='module')
+def fitted(tmp_path_factory):
+    # QE-POS-20MIN-Mixture_processed.xlsx and .json, as written by Module1-2.
+    folder = tmp_path_factory.mktemp('fitted')
+    construction.process_excel(TRAINING, str(folder))
+    return folder / 'QE-POS-20MIN-Mixture_processed'
+
+def add_model(fitted, folder, name, mtime, extensions=('.xlsx',)):
+    for extension in extensions:
+        path = folder / (name + '_processed' + extension)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy(str(fitted) + extension, path)
+        os.utime(path, (mtime, mtime))
+
+def test_json_model_is_used_over_its_excel_file(fitted, tmp_path):
+    add_model(fitted, tmp_path, 'QE-POS-20MIN-Mixture', 1000, ('.xlsx', '.json'))
+    registry = ModelRegistry(str(tmp_path))
+    json_model = str(tmp_path / 'QE-POS-20MIN-Mixture_processed.json')
+    assert registry.models == {'QE-POS-20MIN-Mixture_processed': json_model}
+
+def test_model_of_the_same_subfolder_then_the_newest(fitted, tmp_path):
+    add_model(fitted, tmp_path, 'QE-POS-20MIN-Mixture', 3000)
+    add_model(fitted, tmp_path, 'QE/QE-POS-new', 2000)
+    add_model(fitted, tmp_path, 'QE/QE-POS-old', 1000)
+    registry = ModelRegistry(str(tmp_path))
+    assert registry.select('QE/QE-POS-20MIN-Cell-1') == str(tmp_path / 'QE' / 'QE-POS-new_processed.xlsx')
+    assert registry.select('QE-POS-20MIN-Cell-1') == str(tmp_path / 'QE-POS-20MIN-Mixture_processed.xlsx')
+    assert registry.select('Other/QE-POS-20MIN-Cell-1') == str(tmp_path / 'QE-POS-20MIN-Mixture_processed.xlsx')
+    assert registry.select('QE/QE-NEG-20MIN-Cell-1') is None
+
+def test_several_models_reported_once_per_instrument_and_polarity(fitted, tmp_path, capsys):
+    add_model(fitted, tmp_path, 'QE-POS-a', 1000)
+    add_model(fitted, tmp_path, 'QE-POS-b', 2000)
+    frames = {f'QE-POS-20MIN-{sample}': None for sample in ('Cell', 'Plasma', 'Tissue', 'Yeast')}
+    selected = select_models(str(tmp_path), frames, msdial.read_index_table)
+    assert capsys.readouterr().out.count('Several ECN models for QE POS') == 1
+    assert len(selected) == 1 and selected[0][3] == list(frames)
+
+def test_pooled_model_is_not_preferred(fitted, tmp_path):
+    add_model(fitted, tmp_path, 'QE/QE-POS-20MIN-Mixture', 1000)
+    add_model(fitted, tmp_path, 'QE-POS-20MIN-Mixture', 2000)
+    add_model(fitted, tmp_path, 'pooled/QE-POS-pooled', 3000)
+    add_model(fitted, tmp_path, 'pooled/QE-NEG-pooled', 3000)
+    registry = ModelRegistry(str(tmp_path))
+    assert registry.select('QE/QE-POS-20MIN-Cell-1') == str(tmp_path / 'QE' / 'QE-POS-20MIN-Mixture_processed.xlsx')
+    assert registry.select('Other/QE-POS-20MIN-Cell-1') == str(tmp_path / 'QE-POS-20MIN-Mixture_processed.xlsx')
+    # A pooled model is still used when it is the only one, or in the input's own subfolder.
+    assert registry.select('QE-NEG-20MIN-Cell-1') == str(tmp_path / 'pooled' / 'QE-NEG-pooled_processed.xlsx')
+    assert registry.select('pooled/QE-POS-20MIN-Cell-1') == str(tmp_path / 'pooled' / 'QE-POS-pooled_processed.xlsx')
@@ -0,0 +1,48 @@
+#Tests of the storage layer (ecn_tool.storage)
+import numpy as np
+import pandas as pd
+import pytest
+from ecn_tool.storage import decimal_floats, iter_table, read_table, write_chunks
+
+pytest.importorskip('pyarrow')
+
+def chunks():
+    # The first chunk has a text column (Adduct) that is empty, read as all-null, and an all-NaN float column
+    # (Note); later chunks have text in both, and categories of their own.
+    yield pd.DataFrame({'Name': ['PC 34:1', 'PE 36:2'], 'Adduct': [None, None], 'Note': [np.nan, np.nan],
+                        'Carbon number': [34, 36], 'Ontology': pd.Categorical(['PC', 'PE'])})
+    yield pd.DataFrame({'Name': ['TG 52:2', 'PC 36:4'], 'Adduct': ['[M+NH4]+', None], 'Note': ['isomer', np.nan],
+                        'Carbon number': [52.0, np.nan], 'Ontology': pd.Categorical(['TG', 'PC'])})
+    yield pd.DataFrame({'Name': ['SM 34:1'], 'Adduct': [None], 'Note': [np.nan], 'Carbon number': [34],
+                        'Ontology': pd.Categorical(['SM'])})
+
+@pytest.mark.parametrize('fmt', ['parquet', 'arrow'])
+def test_write_chunks_widens_columns_of_later_chunks(tmp_path, fmt):
+    path = str(tmp_path / f'table.{fmt}')
+    assert write_chunks(chunks(), path) == path
+    assert [file.name for file in tmp_path.iterdir()] == [f'table.{fmt}']
+    df = read_table(path)
+    assert df['Name'].tolist() == ['PC 34:1', 'PE 36:2', 'TG 52:2', 'PC 36:4', 'SM 34:1']
+    assert df['Adduct'].tolist()[2] == '[M+NH4]+' and df['Adduct'].isna().sum() == 4
+    assert df['Note'].tolist()[2] == 'isomer' and df['Note'].isna().sum() == 4
+    assert df['Carbon number'].tolist()[:3] == [34, 36, 52] and np.isnan(df['Carbon number'][3])
+    assert isinstance(df['Ontology'].dtype, pd.CategoricalDtype)
+    assert df['Ontology'].astype(str).tolist() == ['PC', 'PE', 'TG', 'PC', 'SM']
+
+@pytest.mark.parametrize('fmt', ['parquet', 'arrow'])
+def test_write_chunks_round_trips_through_iter_table(tmp_path, fmt):
+    path = str(tmp_path / f'table.{fmt}')
+    write_chunks(chunks(), path)
+    whole = read_table(path)
+    again = pd.concat(iter_table(path, 2), ignore_index=True)
+    pd.testing.assert_frame_equal(again.astype({'Ontology': str}), whole.astype({'Ontology': str}))
+
+def test_text_export_keeps_intensities_exact(tmp_path):
+    path = tmp_path / 'export.txt'
+    path.write_text('Name\tOntology\tRT (min)\tHeight\tTopRT\tIntensity\n'
+                    'PC 34:1\tPC\t8.086\t113900411\t1.46642657472828\t0.00299838316159088\n')
+    df = read_table(str(path))
+    assert df['Height'].tolist() == [113900411]
+    assert df['TopRT'].tolist() == [1.46642657472828]
+    assert df['Intensity'].tolist() == [0.00299838316159088]
+    assert decimal_floats(df)['RT (min)'].tolist() == [8.086]